@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Ravshello Authors
+# License: Apache License 2.0 (see LICENSE or http://apache.org/licenses/LICENSE-2.0.html)
+
+# Modules from standard library
+from __future__ import print_function
+from time import time
+from collections import deque
+from threading import Lock, local, current_thread
+from contextlib import contextmanager
+import logging
+import json
+
+# Custom modules
+from . import cfg
+
+
+def summarize_arg(arg, maxLen=60):
+    """Return short string describing API call argument *arg*."""
+    if isinstance(arg, dict):
+        for k in 'id', 'name':
+            if k in arg:
+                return "{{{}: {}}}".format(k, arg[k])
+        s = "{{{} keys}}".format(len(arg))
+    elif isinstance(arg, list):
+        s = "[{} items]".format(len(arg))
+    else:
+        s = repr(arg)
+    if len(s) > maxLen:
+        s = s[:maxLen - 3] + '...'
+    return s
+
+
+@contextmanager
+def attribute_to(client, command):
+    """Attribute calls made by the current thread within the block to *command*.
+    
+    Does nothing unless *client* is a TracingClient. Worker threads doing
+    part of a command (e.g. refresh_all's) should use this w/the command of
+    the thread that started them, which get_command() returns.
+    """
+    if not isinstance(client, TracingClient):
+        yield
+        return
+    saved = client.get_command()
+    client.set_command(command)
+    try:
+        yield
+    finally:
+        client.set_command(saved)
+
+
+class _AttemptCounter(logging.Handler):
+    """Catch the SDK's per-attempt debug messages, which is how retries are seen."""
+    
+    def __init__(self, tracer):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.tracer = tracer
+    
+    def emit(self, record):
+        rec = getattr(self.tracer._local, 'record', None)
+        if rec is None:
+            return
+        msg = record.getMessage()
+        if msg.startswith('request: '):
+            rec['attempts'] += 1
+        elif msg.startswith('response: '):
+            try:
+                rec['statuses'].append(int(msg.split()[1]))
+            except:
+                pass
+
+
+class TracingClient(object):
+    """Transparent proxy around a RavelloClient that traces every API call.
+    
+    Each call of a public client method results in one record, which is
+    appended as a line of json to file *traceFile* (if given; IOError is
+    raised right away if it can't be opened) and kept in memory (the most
+    recent *maxRecords* of them). Records hold the method name, a summary of
+    the args, the ravshello command being run, every HTTP request made
+    (method, path, status), the number of attempts, response bytes, wall
+    time & the error, if any.
+    """
+    
+    def __init__(self, client, traceFile=None, maxRecords=None):
+        if maxRecords is None:
+            maxRecords = cfg.defaultApiTraceRecords
+        object.__setattr__(self, '_client', client)
+        # Line-buffered, so the file can be followed while ravshello runs
+        if traceFile:
+            traceFile = open(traceFile, 'a', 1)
+        object.__setattr__(self, '_traceFile', traceFile)
+        object.__setattr__(self, 'records', deque(maxlen=maxRecords))
+        # Ravshello command being run, per thread ident
+        object.__setattr__(self, '_commands', {})
+        object.__setattr__(self, '_local', local())
+        object.__setattr__(self, '_lock', Lock())
+        # Instance attribute shadows the method, so calls made from inside
+        # the client (which is where all HTTP requests come from) get traced
+        origRequest = client._request
+        def _request(method, path, body=b'', headers=None):
+            return self._trace_request(origRequest, method, path, body, headers)
+        client._request = _request
+        logger = logging.getLogger('ravello')
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(_AttemptCounter(self))
+        # Keep SDK debug chatter out of the terminal
+        logger.propagate = False
+    
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        def traced(*args, **kwargs):
+            return self._trace_call(name, attr, args, kwargs)
+        traced.__name__ = name
+        traced.__doc__ = attr.__doc__
+        return traced
+    
+    def __setattr__(self, name, value):
+        setattr(self._client, name, value)
+    
+    def set_command(self, command):
+        """Attribute calls from the current thread to ravshello *command* (or None)."""
+        with self._lock:
+            if command is None:
+                self._commands.pop(current_thread().ident, None)
+            else:
+                self._commands[current_thread().ident] = command
+    
+    def get_command(self):
+        """Return ravshello command calls from the current thread are attributed to."""
+        return self._commands.get(current_thread().ident)
+    
+    def _trace_call(self, name, func, args, kwargs):
+        if getattr(self._local, 'record', None) is not None:
+            # Nested call (e.g. a client method given a proxied callback)
+            return func(*args, **kwargs)
+        thread = current_thread()
+        rec = {
+            'time': time(),
+            'call': name,
+            'args': [summarize_arg(a) for a in args] +
+                    ["{}={}".format(k, summarize_arg(v)) for k, v in sorted(kwargs.items())],
+            'command': self._commands.get(thread.ident),
+            'thread': thread.name,
+            'http': [],
+            'attempts': 0,
+            'statuses': [],
+            'bytes': 0,
+            'error': None,
+            }
+        self._local.record = rec
+        start = time()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            rec['error'] = "{}: {}".format(e.__class__.__name__, e)
+            raise
+        finally:
+            rec['sec'] = round(time() - start, 4)
+            rec['retries'] = max(rec['attempts'] - len(rec['http']), 0)
+            self._local.record = None
+            self._write(rec)
+    
+    def _trace_request(self, origRequest, method, path, body, headers):
+        rec = getattr(self._local, 'record', None)
+        if rec is None:
+            return origRequest(method, path, body, headers)
+        req = [method, path, None]
+        rec['http'].append(req)
+        try:
+            response = origRequest(method, path, body, headers)
+        except Exception as e:
+            # E.g. requests' HTTPError, raised for a 429
+            req[2] = getattr(getattr(e, 'response', None), 'status_code', None)
+            raise
+        req[2] = response.status_code
+        try:
+            rec['bytes'] += len(response.content)
+        except:
+            pass
+        return response
+    
+    def _write(self, rec):
+        with self._lock:
+            self.records.append(rec)
+            if not self._traceFile:
+                return
+            try:
+                self._traceFile.write(json.dumps(rec, sort_keys=True) + '\n')
+            except:
+                pass
+    
+    def get_summary(self):
+        """Return list of per-command totals of the in-memory records, busiest first."""
+        totals = {}
+        with self._lock:
+            records = list(self.records)
+        for rec in records:
+            key = rec['command'] or '({})'.format(rec['thread'])
+            t = totals.setdefault(key, {
+                'command': key, 'calls': 0, 'requests': 0, 'retries': 0,
+                'errors': 0, 'throttled': 0, 'bytes': 0, 'sec': 0.0})
+            t['calls'] += 1
+            t['requests'] += len(rec['http'])
+            t['retries'] += rec['retries']
+            t['errors'] += 1 if rec['error'] else 0
+            t['throttled'] += rec['statuses'].count(429)
+            t['bytes'] += rec['bytes']
+            t['sec'] += rec['sec']
+        return sorted(totals.values(), key=lambda t: t['requests'], reverse=True)
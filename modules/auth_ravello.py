@@ -6,10 +6,18 @@
 from __future__ import print_function
 from getpass import getpass
 from sys import exit, stderr
+from time import time
+import os
+import re
+import json
+import atexit
+
+# Modules not from standard library, but required by ravello_sdk anyway
+import requests
 
 # Custom modules
 from . import string_ops as c
-from . import cfg
+from . import cfg, transport
 try:
     from . import ravello_sdk
     ravello_sdk.is_rsaw_sdk()
@@ -54,12 +62,95 @@ def get_passphrase(prompt="Enter passphrase: ", defaultPass=None):
     return passwd
 
 
+def get_session_file(user):
+    """Return path of the saved session file for Ravello user *user*."""
+    return os.path.join(
+        cfg.opts.userCfgDir, 'session-{}.json'.format(re.sub(r'[^\w.@-]', '_', user)))
+
+
+def track_login_time(rClient):
+    """Keep rClient.loginTime set to when *rClient* last really logged in.
+    
+    That's when its session started, which is what sessionMaxAge counts
+    from. Besides login(), the client logs in on its own when a request is
+    rejected w/http 401, so this hooks in by shadowing its _login() method.
+    """
+    rClient.loginTime = None
+    origLogin = rClient._login
+    def _login():
+        origLogin()
+        rClient.loginTime = time()
+    rClient._login = _login
+
+
+def save_session(rClient, user, sessionFile):
+    """Save session cookies of *rClient* to *sessionFile* (mode 0600)."""
+    session = rClient._connection
+    if session is None or rClient.loginTime is None:
+        return
+    saved = {
+        'user': user,
+        'url': rClient.default_url,
+        'time': rClient.loginTime,
+        'cookies': [
+            {'name': ck.name, 'value': ck.value, 'domain': ck.domain,
+             'path': ck.path, 'secure': ck.secure, 'expires': ck.expires}
+            for ck in session.cookies],
+        }
+    tmpPath = sessionFile + '.tmp'
+    try:
+        fd = os.open(tmpPath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(saved, f)
+        os.rename(tmpPath, sessionFile)
+    except:
+        pass
+
+
+def resume_session(rClient, user, passwd, sessionFile):
+    """Make *rClient* use the session saved in *sessionFile*, if still usable.
+    
+    Returns True if it does, in which case no login request is made. The
+    credentials are still set, so that when Ravello rejects the session
+    (http 401), the client logs in again on its own & retries.
+    """
+    try:
+        with open(sessionFile) as f:
+            saved = json.load(f)
+    except:
+        return False
+    if (saved.get('user') != user or saved.get('url') != rClient.default_url or
+            time() - saved.get('time', 0) > cfg.sessionMaxAge or not saved.get('cookies')):
+        return False
+    # Same as what RavelloClient.login() does, minus the actual login
+    session = requests.Session()
+    session.proxies = rClient._proxies
+    session.stream = True
+    session.redirects = rClient.redirects
+    for ck in saved['cookies']:
+        if ck['expires'] and ck['expires'] < time():
+            return False
+        session.cookies.set(
+            ck['name'], ck['value'], domain=ck['domain'], path=ck['path'],
+            secure=ck['secure'], expires=ck['expires'])
+    rClient._username = user
+    rClient._password = passwd
+    rClient._connection = session
+    rClient._autologin = True
+    rClient.loginTime = saved['time']
+    return True
+
+
 def login():
     """Determine Ravello credentials and login via RavelloClient object"""
     # Simplify
     rOpt = cfg.opts
     # Create client object
     rClient = ravello_sdk.RavelloClient(retries=rOpt.maxClientRetries)
+    transport.install(
+        rClient, poolSize=rOpt.httpPoolSize, connectTimeout=rOpt.httpConnectTimeout,
+        readTimeout=rOpt.httpReadTimeout, compress=rOpt.httpCompression)
+    track_login_time(rClient)
     c.verbose("\nConnecting to Ravello . . .", file=stderr)
     cfgUser = cfg.cfgFile.get('ravelloUser', None)
     cfgPass = cfg.cfgFile.get('ravelloPass', None)
@@ -115,10 +206,18 @@ def login():
         passwd = get_passphrase(c.CYAN("  Enter Ravello passphrase: "))
     rOpt.ravelloUser = user
     rOpt.ravelloPass = passwd
-    try:
-        rClient.login(rOpt.ravelloUser, rOpt.ravelloPass)
-    except:
-        quit_login_failed()
+    sessionFile = get_session_file(user)
+    if rOpt.reuseSession and resume_session(rClient, user, passwd, sessionFile):
+        c.verbose("  Reusing saved Ravello session", file=stderr)
+    else:
+        try:
+            rClient.login(rOpt.ravelloUser, rOpt.ravelloPass)
+        except:
+            quit_login_failed()
+    if rOpt.reuseSession:
+        save_session(rClient, user, sessionFile)
+        # Session might have been renewed meanwhile
+        atexit.register(save_session, rClient, user, sessionFile)
     if rOpt.printWelcome:
         print(c.GREEN("  Logged in to Ravello as "), end="", file=stderr)
         if rOpt.enableAdminFuncs:
@@ -17,6 +17,94 @@ defaultAppExpireTime = 120
 defaultAppExtendTime = 60
 defaultMaxClientRetries = 3
 
+# Seconds that each type of locally-cached Ravello object is considered fresh
+# (see cacheTtl in config.yaml)
+defaultCacheTtl = {
+    'apps': 120,
+    'appProperties': 600,
+    'appDesign': 300,
+    'appDeployment': 120,
+    'appList': 120,
+    'bps': 300,
+    'users': 600,
+    'alerts': 300,
+    'shares': 300,
+    'keypairs': 600,
+    'costBuckets': 600,
+    'images': 600,
+    'diskImages': 600,
+    'communities': 3600,
+    'pubLocations': 3600,
+    'events': 86400,
+    'appStatus': 30,
+    'vncUrls': 30,
+    }
+
+# Max number of objects of each per-key cached type (e.g. app aspects) before
+# least-recently-used ones are evicted (see cacheMaxEntries in config.yaml)
+defaultCacheMaxEntries = 1000
+
+# Max age in seconds of expired cache data that may still be served while it's
+# revalidated (see cacheMaxStale in config.yaml)
+defaultCacheMaxStale = 900
+
+# Seconds between polls of the notifications feed to evict changed objects from
+# the cache; 0 disables (see cacheWatchInterval in config.yaml)
+defaultCacheWatchInterval = 0
+
+# Max number of collections fetched at once by the startup prefetch (see
+# prefetch in config.yaml)
+defaultPrefetchThreads = 6
+
+# Subtrees refreshed by the root refresh_all command (& --refresh-all option),
+# along with how many of them to refresh at the same time
+refreshAllNodes = ['apps', 'blueprints', 'users', 'events', 'shared', 'keypairs']
+defaultRefreshAllThreads = 4
+
+# Max number of background fetches started on navigation into apps (see
+# speculate in config.yaml)
+defaultSpeculateThreads = 2
+
+# Client-side rate limits per class of API request, in requests per second
+# (0 means unlimited) w/bursts of up to *burst* requests (see rateLimits in
+# config.yaml)
+defaultRateLimits = {
+    'list': {'rate': 2, 'burst': 6},
+    'read': {'rate': 10, 'burst': 20},
+    'mutation': {'rate': 5, 'burst': 10},
+    }
+
+# How many times a request answered w/http 429 (too many requests) is retried
+# after backing off (see throttleRetries in config.yaml), and the max number
+# of seconds to back off for when the server doesn't say
+defaultThrottleRetries = 5
+maxThrottleBackoff = 60
+
+# Max age in seconds of a saved Ravello session that will be reused (see
+# reuseSession in config.yaml)
+sessionMaxAge = 4 * 3600
+
+# HTTP transport used by RavelloClient (see httpPoolSize & friends in
+# config.yaml); timeouts are in seconds
+defaultHttpPoolSize = 12
+defaultHttpConnectTimeout = 10
+defaultHttpReadTimeout = 60
+defaultHttpCompression = True
+
+# Host-wide request budget shared by all ravshello & rav-notify processes (see
+# sharedBudgetRate in config.yaml); 0 disables it. Processes that made no
+# requests for sharedBudgetActiveWindow seconds don't get a share.
+defaultSharedBudgetRate = 0
+defaultSharedBudgetFile = '/var/tmp/ravshello-api-budget.json'
+sharedBudgetActiveWindow = 30
+
+# Number of recent API call records kept in memory by --trace-api (see
+# traceApiFile in config.yaml)
+defaultApiTraceRecords = 5000
+
+# How long (in seconds) path completion reuses a directory listing
+completionPathTtl = 5
+
 # Some learner mode rules
 maxLearnerPublishedApps = 3
 maxLearnerActiveVms = 8
@@ -62,6 +150,9 @@ appCostBucket = None
 # This will hold the RavelloClient object
 rClient = None
 
+# This will hold the RequestScheduler pacing rClient's requests
+rScheduler = None
+
 # This will hold the RavelloCache object
 rCache = None
 
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Ravshello Authors
+# License: Apache License 2.0 (see LICENSE or http://apache.org/licenses/LICENSE-2.0.html)
+
+# Modules from standard library
+from __future__ import print_function
+from bisect import bisect_left
+from threading import Lock
+
+
+class PrefixIndex(object):
+    """Sorted list of unique strings that answers prefix queries by bisection."""
+    
+    def __init__(self, words):
+        self.words = sorted(set(words))
+    
+    def match(self, prefix):
+        """Return all words starting with *prefix*, in sorted order."""
+        words = self.words
+        i = bisect_left(words, prefix)
+        matches = []
+        while i < len(words) and words[i].startswith(prefix):
+            matches.append(words[i])
+            i += 1
+        return matches
+    
+    def __len__(self):
+        return len(self.words)
+
+
+class Completer(object):
+    """Memoize tab-completion candidates derived from RavelloCache contents.
+    
+    Candidate sets are built once per key -- normally (command, param), plus
+    whatever other parameter values the set depends on -- and kept until one
+    of the cache buckets they were built from changes. Sets built from a
+    collection bucket (or from a single bucket entry) are also rebuilt once
+    it falls out of its ttl, so that completion keeps triggering the usual
+    revalidation.
+    """
+    
+    def __init__(self, rCache):
+        self.rCache = rCache
+        self._memo = {}
+        self._lock = Lock()
+    
+    def _state(self, deps):
+        state = []
+        for dep in deps:
+            if isinstance(dep, tuple):
+                name, key = dep
+            else:
+                name, key = dep, None
+            b = self.rCache.buckets[name]
+            if key is not None:
+                if not b.has_fresh(key):
+                    return None
+            elif name in self.rCache.collectionTypes and not b.is_loaded():
+                return None
+            state.append(b.version)
+        return tuple(state)
+    
+    def get_index(self, key, deps, build):
+        """Return PrefixIndex of build() output, reusing it while *deps* are unchanged.
+        
+        *deps* is a list of RavelloCache bucket names that build() reads from,
+        or of (bucketName, key) tuples where it only reads a single entry.
+        """
+        with self._lock:
+            memo = self._memo.get(key)
+        # Snapshot is taken before building, so that changes made while
+        # building (e.g. by another thread refreshing the cache) aren't missed
+        state = self._state(deps)
+        if memo and state is not None and memo[0] == state:
+            return memo[1]
+        index = PrefixIndex(build())
+        if state is None:
+            # build() probably just (re)loaded the collection
+            state = self._state(deps)
+        with self._lock:
+            self._memo[key] = (state, index)
+        return index
+    
+    def complete(self, key, text, deps, build, fixed=()):
+        """Return completions for *text*, from *fixed* and memoized build() output.
+        
+        The return value follows ui_complete_*() conventions.
+        """
+        completions = [a for a in fixed if a.startswith(text)]
+        completions.extend(self.get_index(key, deps, build).match(text))
+        if len(completions) == 1:
+            return [completions[0] + ' ']
+        return completions
+    
+    def invalidate(self, key=None):
+        """Forget the candidate set for *key* (or all of them)."""
+        with self._lock:
+            if key is None:
+                self._memo.clear()
+            else:
+                self._memo.pop(key, None)
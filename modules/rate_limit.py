@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Ravshello Authors
+# License: Apache License 2.0 (see LICENSE or http://apache.org/licenses/LICENSE-2.0.html)
+
+# Modules from standard library
+from __future__ import print_function
+from time import time, sleep
+from threading import Lock, Condition, local, current_thread
+from contextlib import contextmanager
+from random import uniform
+import heapq
+import re
+import os
+import errno
+import fcntl
+import stat
+import json
+
+# Custom modules
+from . import cfg
+
+# Request priorities; lower numbers go first
+INTERACTIVE, POLLING, BACKGROUND = range(3)
+
+_local = local()
+
+def get_priority():
+    """Return priority of requests made by the current thread.
+    
+    Unless set by priority(), that's INTERACTIVE for the main thread (where
+    user commands run) and BACKGROUND for the rest (prefetch, revalidation,
+    etc); threads doing something else (e.g. refresh_all workers, or the
+    main thread of a poller) should say so w/priority() or set_priority().
+    """
+    p = getattr(_local, 'priority', None)
+    if p is None:
+        if current_thread().name == 'MainThread':
+            return INTERACTIVE
+        return BACKGROUND
+    return p
+
+
+def set_priority(p):
+    """Make requests made by the current thread from now on use priority *p*.
+    
+    Passing None reverts to the default (see get_priority()).
+    """
+    _local.priority = p
+
+
+@contextmanager
+def priority(p):
+    """Make requests made by the current thread within the block use priority *p*."""
+    saved = getattr(_local, 'priority', None)
+    set_priority(p)
+    try:
+        yield
+    finally:
+        set_priority(saved)
+
+
+def get_endpoint_class(method, path):
+    """Return 'list', 'read' or 'mutation' for an API request."""
+    path = path.split('?')[0].rstrip('/')
+    if method == 'GET':
+        # Point reads end in an id, optionally w/an aspect (e.g. ;deployment)
+        # or a sub-resource (e.g. /vms/123/vncUrl)
+        if re.search(r'/\d+(;\w+)?(/[a-zA-Z]+)?$', path):
+            return 'read'
+        return 'list'
+    elif method == 'POST' and path.endswith(('/filter', '/search')):
+        return 'list'
+    return 'mutation'
+
+
+class TokenBucket(object):
+    """Hand out tokens at *rate* per second, saving up to *burst* of them.
+    
+    Waiters are served in priority order. Lower-priority waiters leave the
+    last *reserve* tokens to INTERACTIVE ones. On throttle(), the rate is
+    halved (down to *minRate*) and nobody is served until the backoff delay
+    passes; every success afterwards wins back a tenth of the configured
+    rate. A *rate* of 0 disables limiting.
+    """
+    
+    def __init__(self, name, rate, burst, reserve=1, minRate=0.1):
+        self.name = name
+        self.baseRate = self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.reserve = min(reserve, self.burst - 1)
+        self.minRate = min(minRate, self.rate)
+        self.tokens = self.burst
+        self.stamp = time()
+        self.blockedUntil = 0
+        self._cond = Condition(Lock())
+        self._waiters = []
+        self._seq = 0
+        self.stats = {'requests': 0, 'waits': 0, 'waitTime': 0.0, 'throttled': 0}
+    
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+    
+    def acquire(self, priority=INTERACTIVE):
+        """Block until a token is available for a request of *priority*."""
+        if not self.baseRate:
+            return
+        start = time()
+        with self._cond:
+            self._seq += 1
+            me = (priority, self._seq)
+            heapq.heappush(self._waiters, me)
+            try:
+                while True:
+                    now = time()
+                    self._refill(now)
+                    need = 1 if priority == INTERACTIVE else 1 + self.reserve
+                    if now < self.blockedUntil:
+                        timeout = self.blockedUntil - now
+                    elif self._waiters[0] != me:
+                        timeout = None
+                    elif self.tokens >= need:
+                        break
+                    else:
+                        timeout = (need - self.tokens) / self.rate
+                    self._cond.wait(timeout)
+                heapq.heappop(self._waiters)
+                self.tokens -= 1
+                self.stats['requests'] += 1
+                waited = time() - start
+                if waited > 0.001:
+                    self.stats['waits'] += 1
+                    self.stats['waitTime'] += waited
+            finally:
+                if me in self._waiters:
+                    self._waiters.remove(me)
+                    heapq.heapify(self._waiters)
+                # Next in line might be able to go now
+                self._cond.notify_all()
+    
+    def throttle(self, attempt, retryAfter=None):
+        """Slow down after a 429; return number of seconds to wait before retrying."""
+        if retryAfter is None:
+            # Exponential backoff w/full jitter
+            delay = uniform(0, min(cfg.maxThrottleBackoff, 2 ** attempt))
+        else:
+            delay = retryAfter + uniform(0, 1)
+        with self._cond:
+            self.stats['throttled'] += 1
+            if self.baseRate:
+                self.rate = max(self.rate / 2, self.minRate)
+                self.tokens = min(self.tokens, 0)
+            self.blockedUntil = max(self.blockedUntil, time() + delay)
+            self._cond.notify_all()
+        return delay
+    
+    def succeed(self):
+        if self.rate < self.baseRate:
+            with self._cond:
+                self.rate = min(self.rate + self.baseRate / 10, self.baseRate)
+
+
+def _parse_budget(data, now):
+    """Return dict of valid, active-looking process entries from budget file *data*.
+    
+    The file is writable by other users, so anything malformed is dropped and
+    timestamps in the future are pulled back to *now*.
+    """
+    try:
+        procs = json.loads(data)['procs']
+    except:
+        return {}
+    if not isinstance(procs, dict):
+        return {}
+    valid = {}
+    for pid, p in procs.items():
+        try:
+            if not pid.isdigit() or int(pid) < 1:
+                continue
+            tokens, stamp, seen, uid = p['tokens'], p['stamp'], p['seen'], p['uid']
+            if not all(type(x) in (int, float) for x in (tokens, stamp, seen)):
+                continue
+            if type(uid) is not int:
+                continue
+        except:
+            continue
+        valid[pid] = {
+            'tokens': max(tokens, 0.0),
+            'stamp': min(stamp, now),
+            'seen': min(seen, now),
+            'uid': uid,
+            }
+    return valid
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM means it exists, but belongs to another user
+        return e.errno != errno.ESRCH
+    return True
+
+
+def _is_participant(pid, uid):
+    """Return True if process *pid* is a ravshello or rav-notify run by user *uid*.
+    
+    This keeps entries forged for unrelated processes (e.g. pid 1) from
+    taking a share. Where /proc can't tell (not Linux, or other users'
+    processes hidden), it settles for the process existing.
+    """
+    try:
+        owner = os.stat('/proc/{}'.format(pid)).st_uid
+        with open('/proc/{}/cmdline'.format(pid)) as f:
+            args = f.read().split('\0')
+    except (IOError, OSError):
+        return _pid_alive(pid)
+    return owner == uid and any(
+        os.path.basename(a).startswith(('ravshello', 'rav-notify')) for a in args)
+
+
+class HostBudget(object):
+    """Share *rate* requests per second among all ravshello-family processes on the host.
+    
+    The budget is kept in *filePath*, which each process locks w/flock() to
+    take a token from its share. Each process that made requests within the
+    last *activeWindow* seconds gets an equal share of *rate* & of *burst*,
+    so the org-wide rate limit gets spread evenly instead of going to
+    whoever polls fastest; idle processes don't count. Within a process,
+    waiters are served in priority order.
+    
+    So that all users on the host can join in, the file is created writable
+    by its group if its directory isn't world-writable (e.g. a setgid dir
+    owned by a group of ravshello users), otherwise by everyone. Either way
+    symlinks & non-regular files are refused, and bad entries (including
+    ones for processes that aren't ravshello or rav-notify) are ignored.
+    """
+    
+    def __init__(self, filePath, rate, burst=None, activeWindow=None):
+        self.filePath = filePath
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        if activeWindow is None:
+            activeWindow = cfg.sharedBudgetActiveWindow
+        self.activeWindow = activeWindow
+        self.pid = str(os.getpid())
+        self.uid = os.getuid()
+        self._cond = Condition(Lock())
+        self._waiters = []
+        self._seq = 0
+        self.stats = {'requests': 0, 'waits': 0, 'waitTime': 0.0, 'processes': 1}
+        dirMode = os.stat(os.path.dirname(os.path.abspath(filePath))).st_mode
+        mode = 0666 if dirMode & stat.S_IWOTH else 0660
+        self._fd = self._open(filePath, mode)
+        if not stat.S_ISREG(os.fstat(self._fd).st_mode):
+            os.close(self._fd)
+            raise OSError(errno.EINVAL, "Not a regular file", filePath)
+        try:
+            os.fchmod(self._fd, mode)
+        except OSError:
+            # Only the owner can, and they already did
+            pass
+    
+    @staticmethod
+    def _open(filePath, mode):
+        # An existing file must be opened w/out O_CREAT, which fails in sticky
+        # dirs (like /var/tmp) on files owned by others w/fs.protected_regular
+        while True:
+            try:
+                return os.open(filePath, os.O_RDWR | os.O_NOFOLLOW)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            try:
+                return os.open(filePath, os.O_RDWR | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, mode)
+            except OSError as e:
+                # Lost the race to create it, so open it after all
+                if e.errno != errno.EEXIST:
+                    raise
+    
+    def _claim(self):
+        """Take a token from this process' share; return 0 or seconds until one is due."""
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            data = os.read(self._fd, 1 << 20)
+            now = time()
+            procs = dict(
+                (pid, p) for pid, p in _parse_budget(data, now).items()
+                if now - p['seen'] < self.activeWindow and
+                (pid == self.pid or _is_participant(int(pid), p['uid'])))
+            # Newcomers start w/a single token, so restarting doesn't pay
+            me = procs.get(self.pid, {'tokens': 1.0, 'stamp': now})
+            procs[self.pid] = me
+            share = self.rate / len(procs)
+            burst = max(self.burst / len(procs), 1.0)
+            tokens = min(burst, me['tokens'] + (now - me['stamp']) * share)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / share
+            procs[self.pid] = {'tokens': tokens, 'stamp': now, 'seen': now, 'uid': self.uid}
+            self.stats['processes'] = len(procs)
+            data = json.dumps({'procs': procs})
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            os.ftruncate(self._fd, 0)
+            os.write(self._fd, data)
+            return wait
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+    
+    def acquire(self, priority=INTERACTIVE):
+        """Block until this process' share of the budget allows another request."""
+        start = time()
+        with self._cond:
+            self._seq += 1
+            me = (priority, self._seq)
+            heapq.heappush(self._waiters, me)
+            try:
+                while True:
+                    if self._waiters[0] != me:
+                        timeout = None
+                    else:
+                        try:
+                            timeout = self._claim()
+                        except Exception:
+                            # Don't let a broken budget file stop all requests
+                            timeout = 0
+                        if not timeout:
+                            break
+                    self._cond.wait(timeout)
+                heapq.heappop(self._waiters)
+                self.stats['requests'] += 1
+                waited = time() - start
+                if waited > 0.001:
+                    self.stats['waits'] += 1
+                    self.stats['waitTime'] += waited
+            finally:
+                if me in self._waiters:
+                    self._waiters.remove(me)
+                    heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+
+class RequestScheduler(object):
+    """Put client-side rate limits in front of every request a RavelloClient makes.
+    
+    Requests are sorted into endpoint classes (see get_endpoint_class()),
+    each w/its own TokenBucket configured by *limits*, a dict mapping class
+    to {'rate': N, 'burst': N}. A request answered w/http 429 is retried up
+    to *maxRetries* times after backing off, which also makes its class
+    slow down for everyone. If *hostBudget* (a HostBudget) is given, each
+    request must also fit in this process' share of it. The scheduler hooks
+    into *client* by shadowing its _request() method, so the client is used
+    as before.
+    """
+    
+    def __init__(self, client, limits=None, maxRetries=None, hostBudget=None):
+        if limits is None:
+            limits = cfg.defaultRateLimits
+        if maxRetries is None:
+            maxRetries = cfg.defaultThrottleRetries
+        self.maxRetries = maxRetries
+        self.hostBudget = hostBudget
+        self.buckets = {}
+        for name, limit in limits.items():
+            self.buckets[name] = TokenBucket(name, limit['rate'], limit['burst'])
+        origRequest = client._request
+        def _request(method, path, body=b'', headers=None):
+            return self._request(origRequest, method, path, body, headers)
+        client._request = _request
+    
+    def _request(self, origRequest, method, path, body, headers):
+        bucket = self.buckets[get_endpoint_class(method, path)]
+        attempt = 0
+        while True:
+            bucket.acquire(get_priority())
+            if self.hostBudget:
+                self.hostBudget.acquire(get_priority())
+            try:
+                response = origRequest(method, path, body, headers)
+            except Exception as e:
+                response = getattr(e, 'response', None)
+                if getattr(response, 'status_code', None) != 429 or attempt >= self.maxRetries:
+                    raise
+            else:
+                if response.status_code != 429 or attempt >= self.maxRetries:
+                    bucket.succeed()
+                    return response
+            try:
+                retryAfter = float(response.headers.get('Retry-After'))
+            except:
+                retryAfter = None
+            sleep(bucket.throttle(attempt, retryAfter))
+            attempt += 1
+    
+    def get_stats(self):
+        """Return list of stats dicts, one per endpoint class."""
+        stats = []
+        for name in sorted(self.buckets):
+            b = self.buckets[name]
+            d = dict(b.stats)
+            d['name'] = name
+            d['rate'] = b.rate
+            d['baseRate'] = b.baseRate
+            stats.append(d)
+        return stats
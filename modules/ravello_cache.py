@@ -5,223 +5,1102 @@
 # Modules from standard library
 from __future__ import print_function
 from time import time, sleep
+from collections import OrderedDict
+from threading import Thread, Lock, RLock, Event, BoundedSemaphore
+from Queue import Queue, Empty
+import os
+import re
+import json
 
 # Custom modules
-from . import ui_methods as ui
+from . import cfg
+from .records import (
+    to_json, AppRecord, BlueprintRecord, UserRecord, ShareRecord, KeypairRecord,
+    ImageRecord, CommunityRecord)
+
+def get_description_tags(obj):
+    """Return list of hashtags (e.g. '#is_learner_blueprint') in obj['description'].
+    
+    Trailing punctuation (as in "... see #bmc.") isn't part of a tag.
+    """
+    return re.findall(r'#[\w:.~@-]*[\w~@]', obj.get('description') or '')
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls that share a key into a single call.
+    
+    The first caller for a key runs the function; callers arriving while it's
+    in flight block & receive the same result (or exception).
+    """
+    
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+    
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call:
+                leader = False
+            else:
+                leader = True
+                call = self._calls[key] = {'done': Event(), 'result': None, 'error': None}
+        if not leader:
+            call['done'].wait()
+            if call['error']:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = func(*args, **kwargs)
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+        return call['result']
+
+
+class CacheBucket(object):
+    """Hold one type of cached object, with per-entry timestamps & LRU eviction.
+    
+    Behaves enough like a dict (keyed by object id) that existing callers can
+    iterate over it, index it and assign into it. A *ttl* of 0 disables
+    caching; a *maxEntries* of 0 or None disables eviction, which is what
+    buckets loaded whole from a listing need, since a partial collection
+    can't answer lookups. If *recordType*
+    is given, dicts stored in the bucket are trimmed down to that Record type.
+    All methods are safe to call from multiple threads.
+    """
+    
+    def __init__(self, name, ttl, maxEntries=None, recordType=None):
+        self.name = name
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.recordType = recordType
+        # When the full collection was last loaded (None if never/incomplete)
+        self.tstamp = None
+        self._data = OrderedDict()
+        self._ts = {}
+        self._lock = RLock()
+        # Bumped on every purge so in-flight fetches know to discard results
+        self.generation = 0
+        # Bumped on every change to the contents, for consumers memoizing
+        # things derived from them (e.g. tab-completion candidates)
+        self.version = 0
+        # Secondary indexes, as {indexName: (func, {indexValue: set(keys)})}
+        self._indexes = {}
+        self.reset_stats()
+    
+    def reset_stats(self):
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'staleHits': 0,
+            'refreshes': 0,
+            'refreshTime': 0.0,
+            }
+    
+    def count(self, stat, amount=1):
+        with self._lock:
+            self.stats[stat] += amount
+    
+    def get_stats(self):
+        """Return dict of counters plus current number of entries & approx bytes."""
+        with self._lock:
+            d = dict(self.stats)
+            d['entries'] = len(self._data)
+            d['bytes'] = sum(len(json.dumps(v, default=to_json)) for v in self._data.values())
+        d['name'] = self.name
+        d['ttl'] = self.ttl
+        return d
+    
+    def add_index(self, indexName, func):
+        """Maintain index *indexName*, keyed on each value in list func(entry)."""
+        with self._lock:
+            self._indexes[indexName] = (func, {})
+            for key, value in self._data.items():
+                self._index_add(key, value)
+    
+    def _index_add(self, key, value):
+        for func, index in self._indexes.values():
+            try:
+                indexValues = func(value)
+            except:
+                continue
+            for v in indexValues:
+                index.setdefault(v, set()).add(key)
+    
+    def _index_remove(self, key, value):
+        for func, index in self._indexes.values():
+            try:
+                indexValues = func(value)
+            except:
+                continue
+            for v in indexValues:
+                keys = index.get(v)
+                if keys:
+                    keys.discard(key)
+                    if not keys:
+                        del index[v]
+    
+    def _index_rebuild(self):
+        for func, index in self._indexes.values():
+            index.clear()
+        for key, value in self._data.items():
+            self._index_add(key, value)
+    
+    def lookup(self, indexName, indexValue):
+        """Return list of entries whose *indexName* index includes *indexValue*."""
+        with self._lock:
+            keys = self._indexes[indexName][1].get(indexValue, ())
+            return [self._data[k] for k in keys]
+    
+    def lookup_prefix(self, indexName, prefix):
+        """Return list of entries w/any *indexName* index value starting w/*prefix*."""
+        with self._lock:
+            keys = set()
+            for indexValue, k in self._indexes[indexName][1].items():
+                if indexValue.startswith(prefix):
+                    keys.update(k)
+            return [self._data[k] for k in keys]
+    
+    def wrap(self, value):
+        """Return *value* as stored in the bucket (i.e., as its recordType)."""
+        if self.recordType and isinstance(value, dict):
+            return self.recordType(value)
+        return value
+    
+    def is_fresh(self, ts):
+        return ts is not None and time() - ts < self.ttl
+    
+    def expire(self, key=None):
+        """Mark entry *key* (or the full collection) as due for revalidation.
+        
+        Unlike delete(), the data stays available to be served stale.
+        """
+        with self._lock:
+            ts = time() - self.ttl
+            if key is None:
+                if self.tstamp is not None:
+                    self.tstamp = min(self.tstamp, ts)
+            elif key in self._ts:
+                self._ts[key] = min(self._ts[key], ts)
+    
+    def is_loaded(self):
+        """Return True if the full collection was loaded within ttl."""
+        return self.is_fresh(self.tstamp)
+    
+    def is_younger_than(self, seconds, key=None):
+        """Return True if entry *key* (or the full collection) is younger than *seconds*."""
+        if key is None:
+            ts = self.tstamp
+        else:
+            ts = self._ts.get(key)
+        return ts is not None and time() - ts < seconds
+    
+    def has_fresh(self, key):
+        return key in self._data and self.is_fresh(self._ts.get(key))
+    
+    def load(self, items, key='id', generation=None):
+        """Replace contents of bucket with *items*, a full listing from the API.
+        
+        The new contents are swapped in all at once, so that readers on other
+        threads never see a half-loaded bucket. If *generation* is given and
+        the bucket was purged since, *items* are considered outdated & dropped.
+        """
+        now = time()
+        data = OrderedDict((item[key], self.wrap(item)) for item in items)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._ts = dict.fromkeys(data, now)
+            self._data = data
+            self.tstamp = now
+            self._index_rebuild()
+            self.version += 1
+    
+    def put(self, key, value, ts=None, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._data:
+                self._index_remove(key, self._data.pop(key))
+            value = self.wrap(value)
+            self._data[key] = value
+            self._ts[key] = ts or time()
+            self._index_add(key, value)
+            self._evict()
+            self.version += 1
+    
+    def _evict(self):
+        if not self.maxEntries:
+            return
+        while len(self._data) > self.maxEntries:
+            key, value = self._data.popitem(last=False)
+            del self._ts[key]
+            self._index_remove(key, value)
+            self.tstamp = None
+    
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            # Mark as most recently used
+            value = self._data.pop(key)
+            self._data[key] = value
+            return value
+    
+    def get_ts(self, key):
+        return self._ts.get(key)
+    
+    def delete(self, key):
+        with self._lock:
+            self.generation += 1
+            if key in self._data:
+                self._index_remove(key, self._data.pop(key))
+                del self._ts[key]
+                self.version += 1
+    
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data = OrderedDict()
+            self._ts = {}
+            self.tstamp = None
+            self._index_rebuild()
+            self.version += 1
+    
+    def dump(self):
+        """Return bucket contents for json.dump(), which needs default=to_json."""
+        with self._lock:
+            return {
+                'tstamp': self.tstamp,
+                'entries': [[k, self._ts[k], v] for k, v in self._data.items()],
+                }
+    
+    def restore(self, d):
+        """Repopulate the bucket from the output of dump()."""
+        with self._lock:
+            self.clear()
+            for k, ts, v in d['entries']:
+                self.put(k, v, ts)
+            if d['tstamp'] and len(self._data) == len(d['entries']):
+                self.tstamp = d['tstamp']
+    
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+    
+    def values(self):
+        with self._lock:
+            return list(self._data.values())
+    
+    def items(self):
+        with self._lock:
+            return list(self._data.items())
+    
+    def __getitem__(self, key):
+        with self._lock:
+            return self._data[key]
+    
+    def __setitem__(self, key, value):
+        self.put(key, value)
+    
+    def __delitem__(self, key):
+        self.delete(key)
+    
+    def __contains__(self, key):
+        return key in self._data
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __len__(self):
+        return len(self._data)
+
 
 class RavelloCache(object):
     """Provide a way to locally-cache lookups of apps, users, events, etc."""
     
-    def __init__(self, rClient):
-        """Initialize using *client*, an instance of ravello_sdk.RavelloClient()."""
+    resourceTypes = (
+        'apps', 'appProperties', 'appDesign', 'appDeployment', 'appList',
+        'bps', 'users', 'alerts', 'shares', 'keypairs', 'costBuckets',
+        'images', 'diskImages', 'communities', 'pubLocations', 'events',
+        'appStatus', 'vncUrls')
+    
+    # Resource types that are loaded as a whole from a listing API call
+    collectionTypes = (
+        'appList', 'bps', 'users', 'alerts', 'shares', 'keypairs', 'costBuckets',
+        'images', 'diskImages')
+    
+    # Collections loaded by prefetch() (default) at startup
+    prefetchTypes = ('users', 'bps', 'keypairs', 'shares', 'costBuckets', 'appList')
+    
+    # Map app bucket names to the application aspect they hold (None is full)
+    appBuckets = {
+        'apps': None,
+        'appProperties': 'properties',
+        'appDesign': 'design',
+        'appDeployment': 'deployment',
+        }
+    
+    # App buckets whose contents get edited & sent back to the API (e.g. VM
+    # changes are a read-modify-write of the design), so they're never served
+    # stale, which could silently revert changes made elsewhere meanwhile
+    noStaleAppBuckets = ('apps', 'appDesign')
+    
+    # Short-lived per-app buckets holding the untrimmed deployment aspect and
+    # VNC URLs of started VMs, i.e., what query_status & friends print
+    statusBuckets = ('appStatus', 'vncUrls')
+    
+    # Resource types trimmed down to compact records; the rest are kept raw
+    # because their full definitions get edited & sent back to the API
+    recordTypes = {
+        'appProperties': AppRecord,
+        'appDeployment': AppRecord,
+        'appList': AppRecord,
+        'bps': BlueprintRecord,
+        'users': UserRecord,
+        'shares': ShareRecord,
+        'keypairs': KeypairRecord,
+        'images': ImageRecord,
+        'diskImages': ImageRecord,
+        'communities': CommunityRecord,
+        }
+    
+    # Resource types persisted by save_snapshot()
+    snapshotTypes = ('bps', 'users', 'shares', 'keypairs')
+    
+    # Map notification eventType prefixes to the collections they affect
+    eventTypePrefixes = (
+        ('BLUEPRINT', 'bps'),
+        ('USER', 'users'),
+        ('ALERT', 'alerts'),
+        ('SHARE', 'shares'),
+        ('KEY_PAIR', 'keypairs'),
+        ('KEYPAIR', 'keypairs'),
+        ('COST_BUCKET', 'costBuckets'),
+        )
+    
+    def __init__(self, rClient, ttl=None, maxEntries=None, maxStale=None):
+        """Initialize using *client*, an instance of ravello_sdk.RavelloClient().
+        
+        Optional *ttl* is a dict mapping resource type to seconds, overriding
+        cfg.defaultCacheTtl; optional *maxEntries* caps each resource type
+        that's cached per key (collections are always kept whole).
+        If *maxStale* is set, expired data younger than that many seconds is
+        served as-is while a background thread revalidates it.
+        """
         self.r = rClient
-        self.bpCache = {}
-        self.appCache = {}
-        self.userCache = {}
-        self.alertCache = {}
-        self.shareCache = {}
-        self.kpCache = {}
+        self.maxStale = maxStale
+        # Restricts the app list (see set_app_list_filter())
+        self.appListFilter = {}
+        # When each app (key None: all apps) was last purged, which outdates
+        # its entry in the app list (see get_app_summary())
+        self._appPurged = {}
+        # Set to False once the server rejects /applications/filter
+        self._serverFilter = True
+        # Revalidation jobs, as (resourceType, key) tuples
+        self._queue = Queue()
+        self._pending = set()
+        self._refresher = None
+        self._lock = Lock()
+        # Concurrent misses on the same (resourceType, key) share one API call
+        self._flight = SingleFlight()
+        self._watcher = None
+        # Caps concurrent speculative fetches (see speculate())
+        self._speculation = BoundedSemaphore(cfg.defaultSpeculateThreads)
+        self._speculationTarget = None
+        ttls = dict(cfg.defaultCacheTtl)
+        if ttl:
+            ttls.update(ttl)
+        if maxEntries is None:
+            maxEntries = cfg.defaultCacheMaxEntries
+        self.buckets = {}
+        for name in self.resourceTypes:
+            self.buckets[name] = CacheBucket(
+                name, ttls[name],
+                None if name in self.collectionTypes else maxEntries,
+                self.recordTypes.get(name))
+        # Keep the historical attribute names around for direct access
+        self.appCache = self.buckets['apps']
+        self.appListCache = self.buckets['appList']
+        self.bpCache = self.buckets['bps']
+        self.userCache = self.buckets['users']
+        self.alertCache = self.buckets['alerts']
+        self.shareCache = self.buckets['shares']
+        self.kpCache = self.buckets['keypairs']
+        self.costBucketCache = self.buckets['costBuckets']
+        self.imageCache = self.buckets['images']
+        self.diskImageCache = self.buckets['diskImages']
+        self.communityCache = self.buckets['communities']
+        self.appListCache.add_index('name', lambda a: [a['name']])
+        self.bpCache.add_index('name', lambda bp: [bp['name']])
+        self.bpCache.add_index('tag', get_description_tags)
+        self.userCache.add_index('email', lambda u: [u['email']])
+        self._loaders = {
+            'appList': self.update_app_list_cache,
+            'bps': self.update_bp_cache,
+            'users': self.update_user_cache,
+            'alerts': self.update_alert_cache,
+            'shares': self.update_share_cache,
+            'keypairs': self.update_keypair_cache,
+            'costBuckets': self.update_cost_bucket_cache,
+            'images': self.update_image_cache,
+            'diskImages': self.update_diskimage_cache,
+            }
+    
+    def _revalidate(self, name, key=None):
+        """Queue a background refresh of collection *name* (or of its entry *key*)."""
+        job = (name, key)
+        with self._lock:
+            if job in self._pending:
+                return
+            self._pending.add(job)
+            if self._refresher is None:
+                self._refresher = Thread(target=self._refresh_worker, name='RavelloCacheRefresher')
+                self._refresher.daemon = True
+                self._refresher.start()
+        self._queue.put(job)
+    
+    def _refresh_worker(self):
+        while True:
+            name, key = self._queue.get()
+            try:
+                if key is None:
+                    self._load_collection(name)
+                else:
+                    self._load_app(key, self.appBuckets[name])
+            except:
+                # Next read past the maxStale ceiling will retry & raise
+                pass
+            with self._lock:
+                self._pending.discard((name, key))
+    
+    def _fill(self, bucket, fetch, key='id'):
+        """Load *bucket* with the output of *fetch*, unless purged meanwhile."""
+        generation = bucket.generation
+        start = time()
+        items = fetch()
+        bucket.count('refreshes')
+        bucket.count('refreshTime', time() - start)
+        bucket.load(items, key, generation)
+    
+    def _load_collection(self, name):
+        self._flight.do((name, None), self._loaders[name])
+    
+    def _load_app(self, appId, aspect=None):
+        return self._flight.do(
+            (self._app_bucket(aspect).name, appId), self.update_app_cache, appId, aspect)
+    
+    def _get_collection(self, name):
+        """Return bucket *name*, first reloading it if it's stale."""
+        b = self.buckets[name]
+        if b.is_loaded():
+            b.count('hits')
+        elif self.maxStale and b.is_younger_than(self.maxStale):
+            b.count('staleHits')
+            self._revalidate(name)
+        else:
+            b.count('misses')
+            self._load_collection(name)
+        return b
+    
+    def _get_item(self, name, key):
+        return self._get_collection(name).get(key)
+    
+    def _purge(self, name, key=None):
+        if key:
+            self.buckets[name].delete(key)
+        else:
+            self.buckets[name].clear()
     
     def update_bp_cache(self):
-        self._bpCache_tstamp = time()
-        self.bpCache = {}
-        for b in self.r.get_blueprints():
-            self.bpCache[b['id']] = b
+        self._fill(self.bpCache, self.r.get_blueprints)
     
-    def purge_bp_cache(self):
-        self.bpCache = {}
+    def purge_bp_cache(self, bpId=None):
+        self._purge('bps', bpId)
     
     def get_bp(self, bpId):
-        bpId = int(bpId)
-        try:
-            ts = self._bpCache_tstamp
-        except:
-            self.update_bp_cache()
-        else:
-            if ui.get_timestamp_proximity(ts) < -120:
-                self.update_bp_cache()
-        if bpId in self.bpCache:
-            return self.bpCache[bpId]
+        return self._get_item('bps', int(bpId))
+    
+    def get_bp_by_name(self, bpName):
+        bps = self._get_collection('bps').lookup('name', bpName)
+        if bps:
+            return bps[0]
         else:
             return None
     
+    def _filter_my_org(self, bps):
+        return [bp for bp in bps if self.get_user(bp['ownerDetails']['userId'])]
+    
     def get_bps(self, myOrgOnly=False):
-        try:
-            ts = self._bpCache_tstamp
-        except:
-            self.update_bp_cache()
+        bps = self._get_collection('bps').values()
+        if myOrgOnly:
+            return self._filter_my_org(bps)
         else:
-            if ui.get_timestamp_proximity(ts) < -120:
-                self.update_bp_cache()
+            return bps
+    
+    def get_bps_by_tag(self, tags, myOrgOnly=False):
+        """Return bps w/any of *tags* (e.g. '#bmc') present in their description."""
+        b = self._get_collection('bps')
+        bps = {}
+        for tag in tags:
+            # Same as checking `tag in description`, like is_bmc_bp() does
+            for bp in b.lookup_prefix('tag', tag):
+                bps[bp['id']] = bp
         if myOrgOnly:
-            return [bp for bp in self.bpCache.values() if self.get_user(bp['ownerDetails']['userId'])]
+            return self._filter_my_org(bps.values())
+        else:
+            return bps.values()
+    
+    def _app_bucket(self, aspect=None):
+        if aspect:
+            return self.buckets['app' + aspect.capitalize()]
         else:
-            return self.bpCache.values()
+            return self.appCache
     
-    def update_app_cache(self, appId=None):
+    def update_app_cache(self, appId=None, aspect=None):
+        b = self._app_bucket(aspect)
         if appId:
-            self.appCache[appId] = {}
-            self.appCache[appId]['definition'] = self.r.get_application(appId)
-            self.appCache[appId]['ts'] = time()
+            generation = b.generation
+            start = time()
+            a = self.r.get_application(appId, aspect=aspect)
+            b.count('refreshes')
+            b.count('refreshTime', time() - start)
+            b.put(appId, a, generation=generation)
+            # Same type as what's returned on a cache hit
+            return b.wrap(a)
         else:
-            for appId in self.appCache:
+            for appId in b.keys():
+                generation = b.generation
                 try:
-                     a = self.r.get_application(appId)
+                    a = self.r.get_application(appId, aspect=aspect)
                 except:
                     continue
                 else:
-                    self.appCache[appId] = {}
-                    self.appCache[appId]['definition'] = a
-                    self.appCache[appId]['ts'] = time()
+                    b.put(appId, a, generation=generation)
     
-    def purge_app_cache(self, appId=None):
-        if appId:
-            if appId in self.appCache:
-                del self.appCache[appId]
+    def purge_app_cache(self, appId=None, aspect=None):
+        """Purge *aspect* (default: all aspects) of *appId* (default: all apps)."""
+        if aspect:
+            names = ['apps', self._app_bucket(aspect).name]
         else:
-            self.appCache = {}
+            names = self.appBuckets.keys()
+        # Anything that changes an app makes its status & VNC URLs outdated
+        for name in list(names) + list(self.statusBuckets):
+            self._purge(name, appId)
+        self._appPurged[appId] = time()
+    
+    def get_applications(self, namePrefix=None, **properties):
+        """Return list of apps named *namePrefix*... w/given property values.
+        
+        E.g. get_applications('k:rsaw__', published=True). Filtering is done by
+        the server (via /applications/filter) where possible, so only matching
+        apps are downloaded; otherwise the full list is fetched & filtered here.
+        """
+        criteria = []
+        if namePrefix:
+            # There is no prefix operator, so narrow down w/Contains
+            criteria.append({
+                'type': 'SIMPLE', 'operator': 'Contains',
+                'propertyName': 'name', 'operand': namePrefix})
+        for k, v in properties.items():
+            criteria.append({
+                'type': 'SIMPLE', 'operator': 'Equals',
+                'propertyName': k, 'operand': v})
+        apps = None
+        if criteria and self._serverFilter:
+            req = {'type': 'COMPLEX', 'operator': 'And', 'criteria': criteria}
+            try:
+                apps = self.r.request('POST', '/applications/filter', req)
+            except Exception as e:
+                # Only give up on the endpoint if the server rejects it; any
+                # other failure (throttling, timeouts, etc) is passed along
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                if status is None or not 400 <= status < 500 or status in (401, 429):
+                    raise
+                self._serverFilter = False
+            else:
+                # The client returns None instead of raising for http 404
+                if apps is None:
+                    self._serverFilter = False
+        if apps is None:
+            apps = self.r.get_applications()
+        if namePrefix:
+            apps = [a for a in apps if a['name'].startswith(namePrefix)]
+        for k, v in properties.items():
+            apps = [a for a in apps if a.get(k) == v]
+        return apps
+    
+    def set_app_list_filter(self, namePrefix=None, **properties):
+        """Only cache apps matching *namePrefix* & *properties* in the app list.
+        
+        See get_applications(); this is meant for sessions that never show
+        other apps, since they needn't download the whole org's app list.
+        """
+        self.appListFilter = dict(properties)
+        self.appListFilter['namePrefix'] = namePrefix
+        self.purge_app_list_cache()
+    
+    def _fetch_app_list(self):
+        return self.get_applications(**self.appListFilter)
+    
+    def update_app_list_cache(self):
+        self._fill(self.appListCache, self._fetch_app_list)
+    
+    def purge_app_list_cache(self, appId=None):
+        self._purge('appList', appId)
+    
+    def get_app_list(self):
+        """Return summary listing of all apps (that match appListFilter)."""
+        return self._get_collection('appList').values()
+    
+    def get_app_by_name(self, appName):
+        """Return app summary for *appName*, reloading app list on index miss."""
+        start = time()
+        b = self._get_collection('appList')
+        apps = b.lookup('name', appName)
+        if not apps and (b.tstamp is None or b.tstamp < start):
+            # Could've been created outside of this ravshello since last load
+            self._load_collection('appList')
+            apps = b.lookup('name', appName)
+        if apps:
+            return apps[0]
+        else:
+            return None
     
     def get_app(self, appId, aspect=None):
-        if appId not in self.appCache or ui.get_timestamp_proximity(self.appCache[appId]['ts']) < -120:
-            self.update_app_cache(appId)
-        if aspect:
-            return self.appCache[appId]['definition'][aspect]
+        """Return definition of app *appId*.
+        
+        If *aspect* ('properties', 'design' or 'deployment') is given, only that
+        aspect is fetched, though a fresh full definition is used if cached.
+        Top-level properties (name, owner, published, etc) are always present.
+        """
+        if aspect and self.appCache.has_fresh(appId):
+            self.appCache.count('hits')
+            return self.appCache.get(appId)
+        b = self._app_bucket(aspect)
+        if b.has_fresh(appId):
+            b.count('hits')
+        elif (self.maxStale and b.name not in self.noStaleAppBuckets and
+                b.is_younger_than(self.maxStale, appId)):
+            b.count('staleHits')
+            self._revalidate(b.name, appId)
         else:
-            return self.appCache[appId]['definition']
+            b.count('misses')
+            return self._load_app(appId, aspect)
+        return b.get(appId)
+    
+    def get_app_summary(self, appId):
+        """Return what's needed to list app *appId*, ideally w/out an API call.
+        
+        A fresh deployment aspect is used if cached, since it has VM states;
+        otherwise it's the entry from the app list, which is loaded for all
+        apps at once (& reloaded if all apps were purged since). Only apps
+        missing from the list, or purged on their own since it was loaded,
+        are fetched one by one.
+        """
+        b = self.buckets['appDeployment']
+        if b.has_fresh(appId):
+            b.count('hits')
+            return b.get(appId)
+        appList = self._get_collection('appList')
+        if appList.tstamp is None or appList.tstamp < self._appPurged.get(None, 0):
+            self._load_collection('appList')
+        app = appList.get(appId)
+        if app is None or appList.get_ts(appId) < self._appPurged.get(appId, 0):
+            return self.get_app(appId, aspect='deployment')
+        return app
     
     def get_vm(self, appId, vmId, aspect):
-        if appId not in self.appCache or ui.get_timestamp_proximity(self.appCache[appId]['ts']) < -120:
-            self.update_app_cache(appId)
-        for vm in self.appCache[appId]['definition'][aspect]['vms']:
+        for vm in self.get_app(appId, aspect)[aspect]['vms']:
             if vm['id'] == vmId:
                 return vm
     
-    def update_user_cache(self):
-        self._userCache_tstamp = time()
-        self.userCache = {}
-        for u in self.r.get_users():
-            self.userCache[u['id']] = u
+    def _fetch_app_status(self, appId):
+        app = self.r.get_application(appId, aspect='deployment')
+        # Trimmed copy doubles as the deployment aspect for summaries
+        self.buckets['appDeployment'].put(appId, app)
+        return app
     
-    def purge_user_cache(self):
-        self.userCache = {}
+    def get_app_status(self, appId, fresh=False):
+        """Return full (untrimmed) deployment aspect of app *appId*.
+        
+        This is what query_status & ssh_cmd need. It's only kept for the short
+        appStatus ttl, mostly so that a fetch started by speculate() can be
+        used; pass *fresh* to always fetch (e.g. when polling for changes).
+        """
+        if fresh:
+            self.buckets['appStatus'].count('misses')
+            return self._flight.do(
+                ('appStatus', appId), self._fetch_item,
+                'appStatus', appId, self._fetch_app_status, appId)
+        return self._get_or_fetch('appStatus', appId, self._fetch_app_status, appId)
     
-    def get_user(self, userId):
+    def get_vm_status(self, appId, vmId, fresh=False):
+        """Return full deployment definition of VM *vmId* (see get_app_status())."""
+        for vm in self.get_app_status(appId, fresh)['deployment']['vms']:
+            if vm['id'] == vmId:
+                return vm
+    
+    def get_vnc_url(self, appId, vmId):
+        """Return VNC URL of started VM *vmId*, reusing one fetched by speculate()."""
+        b = self.buckets['vncUrls']
+        if b.has_fresh(appId) and vmId in b.get(appId):
+            b.count('hits')
+            return b.get(appId)[vmId]
+        b.count('misses')
+        generation = b.generation
+        url = self.r.get_vnc_url(appId, vmId)
+        urls = dict(b.get(appId) or {})
+        urls[vmId] = url
+        b.put(appId, urls, generation=generation)
+        return url
+    
+    def speculate(self, appId):
+        """Start fetching what commands run on app *appId* are likely to need.
+        
+        Meant to be called when the user navigates to the app (or one of its
+        VMs): the full deployment aspect, the design aspect (VM list) and VNC
+        URLs of started VMs are fetched in the background. At most
+        cfg.defaultSpeculateThreads fetches run at once; if that budget is
+        used up, nothing is started rather than adding to the load. Work left
+        for an app the user has since navigated away from (which is signaled
+        by calling this with None) is abandoned.
+        """
+        self._speculationTarget = appId
+        if appId is None or self.buckets['appStatus'].has_fresh(appId):
+            return None
+        if not self._speculation.acquire(False):
+            return None
+        t = Thread(target=self._speculate_worker, args=(appId,), name='RavelloCacheSpeculate')
+        t.daemon = True
+        t.start()
+        return t
+    
+    def _speculate_worker(self, appId):
         try:
-            ts = self._userCache_tstamp
+            app = self.get_app_status(appId)
+            if self._speculationTarget != appId:
+                return
+            self.get_app(appId, aspect='design')
+            if not app['published']:
+                return
+            for vm in app['deployment']['vms']:
+                if self._speculationTarget != appId:
+                    return
+                if vm['state'] == 'STARTED':
+                    self.get_vnc_url(appId, vm['id'])
         except:
-            self.update_user_cache()
-        else:
-            if ui.get_timestamp_proximity(ts) < -120:
-                self.update_user_cache()
-        if userId in self.userCache:
-            return self.userCache[userId]
+            # Nothing lost; foreground commands will fetch what they need
+            pass
+        finally:
+            self._speculation.release()
+    
+    def update_user_cache(self):
+        self._fill(self.userCache, self.r.get_users)
+    
+    def purge_user_cache(self, userId=None):
+        self._purge('users', userId)
+    
+    def get_user(self, userId):
+        return self._get_item('users', userId)
+    
+    def get_user_by_email(self, email):
+        users = self._get_collection('users').lookup('email', email)
+        if users:
+            return users[0]
         else:
             return None
     
     def get_users(self):
-        try:
-            ts = self._userCache_tstamp
-        except:
-            self.update_user_cache()
-        else:
-            if ui.get_timestamp_proximity(ts) < -120:
-                self.update_user_cache()
-        return self.userCache.values()
+        return self._get_collection('users').values()
     
-    def update_alert_cache(self):
-        self.alertCache = {}
+    def _fetch_alerts(self):
+        alerts = {}
         for alert in self.r.get_alerts():
             a = {
                 'userId': alert['userId'],
                 'alertId': alert['id'],
                 }
-            try:
-                self.alertCache[alert['eventName']].append(a)
-            except:
-                self.alertCache[alert['eventName']] = [a]
-        self.alertCache['_timestamp'] = time()
+            alerts.setdefault(alert['eventName'], []).append(a)
+        return [{'eventName': k, 'alerts': v} for k, v in alerts.items()]
+    
+    def update_alert_cache(self):
+        self._fill(self.alertCache, self._fetch_alerts, key='eventName')
     
     def purge_alert_cache(self):
-        self.alertCache = {}
+        self._purge('alerts')
     
     def get_alerts_for_event(self, eventName):
-        if not len(self.alertCache):
-            self.update_alert_cache()
-        if eventName in self.alertCache:
-            if ui.get_timestamp_proximity(self.alertCache['_timestamp']) < -120:
-                self.update_alert_cache()
-            return self.alertCache[eventName]
+        entry = self._get_item('alerts', eventName)
+        if entry:
+            return entry['alerts']
         else:
             return None
     
     def update_share_cache(self):
-        self._shareCache_tstamp = time()
-        self.shareCache = {}
-        for s in self.r.get_shares():
-            self.shareCache[s['id']] = s
+        self._fill(self.shareCache, self.r.get_shares)
     
     def purge_share_cache(self, shareId=None):
-        if shareId:
-            if shareId in self.shareCache:
-                del self.shareCache[shareId]
-        else:
-            self.shareCache = {}
+        self._purge('shares', shareId)
     
     def get_share(self, shareId):
-        try:
-            ts = self._shareCache_tstamp
-        except:
-            self.update_share_cache()
-        else:
-            if ui.get_timestamp_proximity(ts) < -120:
-                self.update_share_cache()
-        if shareId in self.shareCache:
-            return self.shareCache[shareId]
-        else:
-            return None
+        return self._get_item('shares', shareId)
     
     def get_shares(self):
-        try:
-            ts = self._shareCache_tstamp
-        except:
-            self.update_share_cache()
-        else:
-            if ui.get_timestamp_proximity(ts) < -120:
-                self.update_share_cache()
-        return self.shareCache.values()
+        return self._get_collection('shares').values()
     
     def update_keypair_cache(self):
-        self._kpCache_tstamp = time()
-        self.kpCache = {}
-        for k in self.r.get_keypairs():
-            self.kpCache[k['id']] = k
+        self._fill(self.kpCache, self.r.get_keypairs)
     
     def purge_keypair_cache(self, kpId=None):
-        if kpId:
-            if kpId in self.kpCache:
-                del self.kpCache[kpId]
-        else:
-            self.kpCache = {}
+        self._purge('keypairs', kpId)
     
     def get_keypair(self, kpId):
-        try:
-            ts = self._kpCache_tstamp
-        except:
-            self.update_keypair_cache()
+        return self._get_item('keypairs', kpId)
+    
+    def get_keypairs(self):
+        return self._get_collection('keypairs').values()
+    
+    def _fetch_cost_buckets(self):
+        return self.r.get_cost_buckets(permissions='execute')
+    
+    def update_cost_bucket_cache(self):
+        self._fill(self.costBucketCache, self._fetch_cost_buckets)
+    
+    def purge_cost_bucket_cache(self, costBucketId=None):
+        self._purge('costBuckets', costBucketId)
+    
+    def get_cost_buckets(self):
+        """Return cost buckets the user has execute permission on."""
+        return self._get_collection('costBuckets').values()
+    
+    def update_image_cache(self):
+        self._fill(self.imageCache, self.r.get_images)
+    
+    def purge_image_cache(self, imageId=None):
+        self._purge('images', imageId)
+    
+    def get_image(self, imageId):
+        """Return VM image *imageId* from the (bulk-loaded) library listing."""
+        return self._get_item('images', imageId)
+    
+    def get_images(self):
+        return self._get_collection('images').values()
+    
+    def update_diskimage_cache(self):
+        self._fill(self.diskImageCache, self.r.get_diskimages)
+    
+    def purge_diskimage_cache(self, diskImageId=None):
+        self._purge('diskImages', diskImageId)
+    
+    def get_diskimage(self, diskImageId):
+        """Return disk image *diskImageId* from the (bulk-loaded) library listing."""
+        return self._get_item('diskImages', diskImageId)
+    
+    def get_diskimages(self):
+        return self._get_collection('diskImages').values()
+    
+    def _fetch_item(self, name, key, fetch, *args):
+        b = self.buckets[name]
+        generation = b.generation
+        start = time()
+        value = fetch(*args)
+        b.count('refreshes')
+        b.count('refreshTime', time() - start)
+        b.put(key, value, generation=generation)
+        return b.get(key, b.wrap(value))
+    
+    def _get_or_fetch(self, name, key, fetch, *args):
+        """Return entry *key* of bucket *name*, first storing fetch(*args) if stale."""
+        b = self.buckets[name]
+        if b.has_fresh(key):
+            b.count('hits')
+            return b.get(key)
+        b.count('misses')
+        return self._flight.do((name, key), self._fetch_item, name, key, fetch, *args)
+    
+    def get_community(self, communityId):
+        """Return community *communityId*, which is fetched once & remembered."""
+        return self._get_or_fetch('communities', communityId, self.r.get_community, communityId)
+    
+    def purge_community_cache(self, communityId=None):
+        self._purge('communities', communityId)
+    
+    def get_event_names(self):
+        """Return list of names of events that alerts can be registered for."""
+        return self._get_or_fetch('events', 'names', self.r.get_events)
+    
+    def is_bmc_bp(self, bpId):
+        """Return True if bp *bpId* is tagged for bmc (bare-metal-cloud) regions."""
+        bp = self.get_bp(bpId)
+        description = bp and bp.get('description')
+        return bool(description) and any(tag in description for tag in cfg.bmcBlueprintTag)
+    
+    def _fetch_pub_locations(self, bpId=None, appId=None):
+        if appId:
+            locations = self.r.get_application_publish_locations(appId)
+            bpId = self.get_app(appId, aspect='properties')['baseBlueprintId']
         else:
-            if ui.get_timestamp_proximity(ts) < -120:
-                self.update_keypair_cache()
-        if kpId in self.kpCache:
-            return self.kpCache[kpId]
+            locations = self.r.get_blueprint_publish_locations(bpId)
+        # Blueprints tagged for bmc can only be published to bmc regions, and
+        # all others only to non-bmc regions
+        isBmc = self.is_bmc_bp(bpId)
+        return [r for r in locations if not r['deprecated'] and
+                (r['regionName'] in cfg.bmcRegionNames) == isBmc]
+    
+    def get_pub_locations(self, bpId=None, appId=None):
+        """Return regions that bp *bpId* (or app *appId*) can be published to.
+        
+        Deprecated regions & regions on the wrong side of the bmc split (see
+        is_bmc_bp()) are already filtered out. The returned list is a copy, so
+        callers are free to modify it.
+        """
+        locations = self._get_or_fetch(
+            'pubLocations', self.get_pub_locations_key(bpId, appId),
+            self._fetch_pub_locations, bpId, appId)
+        return [dict(r) for r in locations]
+    
+    def get_pub_locations_key(self, bpId=None, appId=None):
+        """Return key of the pubLocations bucket entry get_pub_locations() uses."""
+        if appId:
+            return 'app:{}'.format(appId)
         else:
-            return None
+            return 'bp:{}'.format(bpId)
     
-    def get_keypairs(self):
+    def load_snapshot(self, filePath):
+        """Populate snapshotTypes buckets from json file *filePath*, if it exists."""
         try:
-            ts = self._kpCache_tstamp
+            with open(filePath) as f:
+                snapshot = json.load(f)
         except:
-            self.update_keypair_cache()
-        else:
-            if ui.get_timestamp_proximity(ts) < -120:
-                self.update_keypair_cache()
-        return self.kpCache.values()
+            return
+        for name in self.snapshotTypes:
+            if name in snapshot.get('buckets', {}):
+                try:
+                    self.buckets[name].restore(snapshot['buckets'][name])
+                except:
+                    self.buckets[name].clear()
+    
+    def save_snapshot(self, filePath):
+        """Save all loaded snapshotTypes buckets to *filePath* (mode 0600)."""
+        snapshot = {'buckets': {}}
+        for name in self.snapshotTypes:
+            if self.buckets[name].tstamp:
+                snapshot['buckets'][name] = self.buckets[name].dump()
+        tmpPath = filePath + '.tmp'
+        try:
+            fd = os.open(tmpPath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f, default=to_json)
+            os.rename(tmpPath, filePath)
+        except:
+            pass
+    
+    def get_stats(self):
+        """Return list of stats dicts, one per resource type."""
+        return [self.buckets[name].get_stats() for name in self.resourceTypes]
+    
+    def reset_stats(self):
+        for b in self.buckets.values():
+            b.reset_stats()
+    
+    def purge(self, name=None):
+        """Purge resource type *name* (default: everything)."""
+        for b in self.buckets.values():
+            if name is None or b.name == name:
+                b.clear()
+    
+    def warm(self, name=None):
+        """Load collection *name* (default: all collections) if not fresh."""
+        for n in self.collectionTypes:
+            if name is None or n == name:
+                if not self.buckets[n].is_loaded():
+                    self._load_collection(n)
+    
+    def prefetch(self, names=None, threads=None):
+        """Start loading collections *names* (default: prefetchTypes) in the background.
+        
+        At most *threads* (default: cfg.defaultPrefetchThreads) collections are
+        fetched at once. Readers that need a collection while it's in flight
+        wait on the same fetch instead of starting their own; a failed fetch
+        is simply retried by the next reader. Returns the started threads.
+        """
+        if names is None:
+            names = self.prefetchTypes
+        if threads is None:
+            threads = cfg.defaultPrefetchThreads
+        jobs = Queue()
+        for name in names:
+            if not self.buckets[name].is_loaded():
+                jobs.put(name)
+        workers = []
+        for i in range(min(threads, jobs.qsize())):
+            t = Thread(target=self._prefetch_worker, args=(jobs,),
+                       name='RavelloCachePrefetch-{}'.format(i))
+            t.daemon = True
+            t.start()
+            workers.append(t)
+        return workers
+    
+    def _prefetch_worker(self, jobs):
+        while True:
+            try:
+                name = jobs.get_nowait()
+            except Empty:
+                return
+            try:
+                self._load_collection(name)
+            except:
+                pass
+    
+    def invalidate_for_event(self, event):
+        """Evict whatever cached data is affected by notification *event*."""
+        eventType = event.get('eventType', '')
+        appId = event.get('appId')
+        if appId:
+            self.purge_app_cache(appId)
+            if eventType == 'APPLICATION_DELETED':
+                self.purge_app_list_cache(appId)
+            else:
+                # List entries include deployment summaries (e.g. active VMs)
+                self.appListCache.expire()
+        for prefix, name in self.eventTypePrefixes:
+            if eventType.startswith(prefix):
+                self.buckets[name].expire()
+    
+    def watch_notifications(self, interval):
+        """Start a thread that polls notifications every *interval* seconds."""
+        if self._watcher:
+            return
+        self._watcher = Thread(target=self._watch_worker, args=(interval,), name='RavelloCacheWatcher')
+        self._watcher.daemon = True
+        self._watcher.start()
+    
+    def _watch_worker(self, interval):
+        # Ravello timestamps are in milliseconds; the query window always
+        # overlaps the previous one by an interval, to catch late arrivals
+        cursor = int((time() - interval) * 1000)
+        seen = {}
+        while True:
+            sleep(interval)
+            end = int(time() * 1000)
+            query = {'dateRange': {'startTime': cursor, 'endTime': end}}
+            try:
+                events = self.r.search_notifications(query)['notification']
+            except:
+                continue
+            for event in events:
+                eventKey = (event.get('eventTimeStamp'), event.get('eventType'), event.get('appId'))
+                if eventKey in seen:
+                    continue
+                seen[eventKey] = event.get('eventTimeStamp') or end
+                self.invalidate_for_event(event)
+            cursor = end - interval * 1000
+            for eventKey, ts in seen.items():
+                if ts < cursor:
+                    del seen[eventKey]
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Ravshello Authors
+# License: Apache License 2.0 (see LICENSE or http://apache.org/licenses/LICENSE-2.0.html)
+
+# Modules from standard library
+from __future__ import print_function
+
+
+class Record(object):
+    """Compact stand-in for a json dict returned by the Ravello API.
+    
+    Only the keys named in __slots__ are kept from the source dict; the rest
+    is dropped. Keys missing from the source are missing from the record too,
+    so that [], get(), `in` & iteration behave as they would on the original
+    dict. Dict (or list of dict) values of the keys in *nested* are converted
+    to the given Record subclass.
+    """
+    
+    __slots__ = ()
+    nested = {}
+    
+    def __init__(self, d):
+        for k in self.__slots__:
+            if k not in d:
+                continue
+            v = d[k]
+            if k in self.nested:
+                v = self._convert(self.nested[k], v)
+            setattr(self, k, v)
+    
+    @staticmethod
+    def _convert(recordType, v):
+        if isinstance(v, dict):
+            return recordType(v)
+        elif isinstance(v, list):
+            return [recordType(i) if isinstance(i, dict) else i for i in v]
+        else:
+            return v
+    
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+    
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        if key in self.nested:
+            value = self._convert(self.nested[key], value)
+        setattr(self, key, value)
+    
+    def __contains__(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __len__(self):
+        return len(self.keys())
+    
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self.to_dict())
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def keys(self):
+        return [k for k in self.__slots__ if hasattr(self, k)]
+    
+    def to_dict(self):
+        """Return contents as a plain (json-serializable) dict."""
+        d = {}
+        for k in self.keys():
+            v = getattr(self, k)
+            if isinstance(v, Record):
+                v = v.to_dict()
+            elif isinstance(v, list):
+                v = [i.to_dict() if isinstance(i, Record) else i for i in v]
+            d[k] = v
+        return d
+
+
+def to_json(obj):
+    """Serialize Records; for use as the *default* arg to json.dump()."""
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError("{!r} is not JSON serializable".format(obj))
+
+
+class UserRefRecord(Record):
+    """Reference to a user embedded in another object, e.g. ownerDetails."""
+    __slots__ = ('userId', 'name', 'nickname', 'email')
+
+
+class VmRecord(Record):
+    __slots__ = ('id', 'name', 'state')
+
+
+class DeploymentRecord(Record):
+    __slots__ = (
+        'regionName', 'totalActiveVms', 'totalErrorVms', 'expirationTime', 'vms')
+    nested = {'vms': VmRecord}
+
+
+class AppRecord(Record):
+    """App summary; holds app list entries as well as properties/deployment aspects."""
+    __slots__ = (
+        'id', 'name', 'description', 'owner', 'ownerDetails', 'creationTime',
+        'published', 'baseBlueprintId', 'deployment')
+    nested = {'ownerDetails': UserRefRecord, 'deployment': DeploymentRecord}
+
+
+class BlueprintRecord(Record):
+    __slots__ = (
+        'id', 'name', 'description', 'owner', 'ownerDetails', 'creationTime')
+    nested = {'ownerDetails': UserRefRecord}
+
+
+class UserRecord(Record):
+    __slots__ = (
+        'id', 'email', 'name', 'surname', 'roles', 'locked', 'activated', 'enabled')
+
+
+class ShareRecord(Record):
+    __slots__ = (
+        'id', 'sharedResourceType', 'sharedResourceId', 'sharingUserId',
+        'targetEmail', 'targetCommunityId', 'time')
+
+
+class ImageRecord(Record):
+    """VM or disk image from the library."""
+    __slots__ = ('id', 'name')
+
+
+class CommunityRecord(Record):
+    __slots__ = ('id', 'name')
+
+
+class KeypairRecord(Record):
+    __slots__ = ('id', 'name', 'creationTime', 'creator')
+    nested = {'creator': UserRefRecord}
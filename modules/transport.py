@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017 Ravshello Authors
+# License: Apache License 2.0 (see LICENSE or http://apache.org/licenses/LICENSE-2.0.html)
+
+# Modules from standard library
+from __future__ import print_function
+
+# Modules not from standard library, but required by ravello_sdk anyway
+from requests.adapters import HTTPAdapter
+
+# Custom modules
+from . import cfg
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter w/a bigger connection pool that asks for compressed responses.
+    
+    RavelloClient builds its requests w/out the session's default headers, so
+    it never sends Accept-Encoding; with *compress* set, gzip is requested
+    (requests decompresses transparently). If *connectTimeout* is given, it
+    is used for connecting, while the client's own timeout still applies to
+    reading responses.
+    """
+    
+    def __init__(self, poolSize, connectTimeout=None, compress=True):
+        self.connectTimeout = connectTimeout
+        self.compress = compress
+        HTTPAdapter.__init__(self, pool_maxsize=poolSize)
+    
+    def send(self, request, **kwargs):
+        if self.compress:
+            request.headers.setdefault('Accept-Encoding', 'gzip, deflate')
+        request.headers.setdefault('Connection', 'keep-alive')
+        timeout = kwargs.get('timeout')
+        if self.connectTimeout and not isinstance(timeout, tuple):
+            kwargs['timeout'] = (self.connectTimeout, timeout)
+        return HTTPAdapter.send(self, request, **kwargs)
+
+
+def install(client, poolSize=None, connectTimeout=None, readTimeout=None, compress=None):
+    """Make RavelloClient *client* use pooled, persistent & compressed connections.
+    
+    The client creates a new requests session on every (re)login, which
+    would mean new connections & TLS handshakes each time; instead, one
+    PooledAdapter (returned) is mounted on all of them, so its connection
+    pool outlives them. Unset args default to their cfg.defaultHttp* value.
+    This hooks in by shadowing the client's _request() method, so it should
+    be installed before logging in & before any other such hooks.
+    """
+    if poolSize is None:
+        poolSize = cfg.defaultHttpPoolSize
+    if connectTimeout is None:
+        connectTimeout = cfg.defaultHttpConnectTimeout
+    if readTimeout is None:
+        readTimeout = cfg.defaultHttpReadTimeout
+    if compress is None:
+        compress = cfg.defaultHttpCompression
+    adapter = PooledAdapter(poolSize, connectTimeout, compress)
+    if readTimeout:
+        client.timeout = readTimeout
+    origRequest = client._request
+    def _request(method, path, body=b'', headers=None):
+        return _pooled_request(client, adapter, origRequest, method, path, body, headers)
+    client._request = _request
+    return adapter
+
+
+def _pooled_request(client, adapter, origRequest, method, path, body, headers):
+    session = client._connection
+    if session is not None and session.adapters.get('https://') is not adapter:
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+    try:
+        response = origRequest(method, path, body, headers)
+    except Exception as e:
+        _release(getattr(e, 'response', None))
+        raise
+    _release(response)
+    return response
+
+
+def _release(response):
+    # The client streams responses, so a connection only goes back to the
+    # pool once its body is read; bodies that aren't json are otherwise not
+    try:
+        response.content
+    except:
+        pass
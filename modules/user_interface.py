@@ -8,8 +8,8 @@ from sys import stdout, stdin, stderr
 from pydoc import pager, pipepager
 from time import sleep, time
 from stat import S_ISDIR
-from os import path, makedirs, chmod, remove, stat
-from glob import glob
+from os import path, makedirs, chmod, remove, stat, listdir
+from glob import glob, has_magic
 from datetime import datetime, date
 from calendar import month_name
 from operator import itemgetter
@@ -19,6 +19,8 @@ import subprocess
 import termios
 import re
 from copy import deepcopy
+from threading import Thread, Lock
+from Queue import Queue, Empty
 
 # Modules not from standard library, but widely available
 try:
@@ -32,8 +34,30 @@ except:
 del ConfigNode.ui_command_bookmarks
 del ConfigNode.ui_complete_bookmarks
 
+# Hook navigation, so that app details can be fetched ahead of need
+_ui_command_cd = ConfigNode.ui_command_cd
+
+def ui_command_cd(self, path=None):
+    target = _ui_command_cd(self, path)
+    if rOpt and rOpt.speculate and isinstance(target, ConfigNode):
+        rCache.speculate(getattr(target, 'appId', None))
+    return target
+
+ui_command_cd.__doc__ = _ui_command_cd.__doc__
+ConfigNode.ui_command_cd = ui_command_cd
+
+# Hook command execution, so that traced API calls (see --trace-api) can be
+# attributed to the command that made them
+_execute_command = ConfigNode.execute_command
+
+def execute_command(self, command, pparams=[], kparams={}):
+    with api_trace.attribute_to(rClient, "{} {}".format(self.path, command)):
+        return _execute_command(self, command, pparams, kparams)
+
+ConfigNode.execute_command = execute_command
+
 # Custom modules
-from . import cfg, ravello_cache
+from . import cfg, ravello_cache, completion, api_trace, rate_limit
 from . import string_ops as c
 from . import ui_methods as ui
 try:
@@ -45,7 +69,7 @@ except:
     raise
 
 # Set aside globals that will be used for code-clarity
-rOpt = user = appnamePrefix = rClient = rCache = rootNode = None
+rOpt = user = appnamePrefix = rClient = rCache = rootNode = completer = None
 
 def is_admin():
     if cfg.opts.enableAdminFuncs:
@@ -54,11 +78,59 @@ def is_admin():
         return False
 
 
+# Directory listings used by _complete_path(), as {dir: (tstamp, names, dirnames)}
+_dirListings = {}
+
+def _list_dir(directory):
+    """Return PrefixIndex of names in *directory* & set of those that are dirs."""
+    now = time()
+    try:
+        ts, names, dirnames = _dirListings[directory]
+    except KeyError:
+        pass
+    else:
+        if now - ts < cfg.completionPathTtl:
+            return names, dirnames
+    dirnames = set()
+    try:
+        entries = listdir(directory or '.')
+    except OSError:
+        entries = []
+    for name in entries:
+        try:
+            if S_ISDIR(stat(path.join(directory, name)).st_mode):
+                dirnames.add(name)
+        except OSError:
+            pass
+    names = completion.PrefixIndex(entries)
+    _dirListings[directory] = now, names, dirnames
+    return names, dirnames
+
+
+def _glob_completions(pathspec):
+    """Yield (entry, isDir) for pathspec*, like glob() would, from cached listings."""
+    expanded = path.expanduser(pathspec)
+    if has_magic(expanded):
+        for entry in glob(expanded + '*'):
+            try:
+                yield entry, S_ISDIR(stat(entry).st_mode)
+            except OSError:
+                yield entry, False
+        return
+    directory, prefix = path.split(expanded)
+    dirPart = expanded[:len(expanded) - len(prefix)]
+    names, dirnames = _list_dir(directory)
+    for name in names.match(prefix):
+        # Same as glob, don't offer hidden files unless asked to
+        if name.startswith('.') and not prefix.startswith('.'):
+            continue
+        yield dirPart + name, name in dirnames
+
+
 def _complete_path(pathspec):
     """Return filenames to ui_complete_*() methods for path completion."""
     filtered = []
-    for entry in glob(path.expanduser(pathspec) + '*'):
-        st = stat(entry)
+    for entry, isDir in _glob_completions(pathspec):
         if pathspec.startswith('~'):
             if pathspec == '~':
                 entry = '~'
@@ -67,7 +139,7 @@ def _complete_path(pathspec):
             else:
                 tildepath = pathspec.split('/')[0]
                 entry = entry.replace(path.expanduser(tildepath), tildepath)
-        if S_ISDIR(st.st_mode):
+        if isDir:
             filtered.append(entry + '/')
         else:
             filtered.append(entry)
@@ -80,14 +152,76 @@ def _complete_path(pathspec):
 
 def get_num_learner_active_vms(learner):
     """Return the number of active VMs a learner has."""
-    activeVms = 0
-    for app in rClient.get_applications(filter={'published': True}):
-        if is_admin() and rOpt.showAllApps or app['name'].startswith(appnamePrefix):
-            try:
-                activeVms += app['deployment']['totalActiveVms']
-            except:
-                pass
-    return activeVms
+    return rootNode.get_child('apps').get_active_vms()
+
+
+def reconcile_children(node, items, idAttr, get_name, create, update=None):
+    """Make the children of *node* match *items*, a fresh listing from the API.
+    
+    Children are matched to items by comparing child attribute *idAttr* to
+    item['id'] (children without that attribute are left alone). Children
+    whose item is gone -- or whose name no longer matches get_name(item) --
+    are removed; items without a matching child are passed to create(item);
+    the rest are passed to update(child, item) if given & otherwise kept
+    as-is, along with all their substate.
+    """
+    children = {}
+    for child in list(node._children):
+        if hasattr(child, idAttr):
+            children[getattr(child, idAttr)] = child
+    new = []
+    for item in items:
+        child = children.pop(item['id'], None)
+        if child is None:
+            new.append(item)
+        elif child.name != get_name(item):
+            node.remove_child(child)
+            new.append(item)
+        elif update:
+            update(child, item)
+    # Whatever is left over was deleted; remove it before creating new nodes,
+    # which might reuse its name
+    for child in children.values():
+        node.remove_child(child)
+    for item in new:
+        create(item)
+
+
+def get_allowed_blueprints():
+    """Return list of my-org blueprints the user may base new apps on."""
+    if is_admin():
+        return rCache.get_bps(myOrgOnly=True)
+    tags = cfg.learnerBlueprintTag + ['#{}{}'.format(cfg.appnameNickPrefix, user)]
+    return rCache.get_bps_by_tag(tags, myOrgOnly=True)
+
+
+def print_cache_stats():
+    """Print a table of RavelloCache counters, one line per resource type."""
+    fmt = "{:<15} {:>7} {:>10} {:>6} {:>7} {:>7} {:>7} {:>9} {:>8}"
+    print(c.BOLD(fmt.format(
+        "TYPE", "ENTRIES", "BYTES", "TTL", "HITS", "STALE", "MISSES", "REFRESHES", "AVG SEC")))
+    for s in rCache.get_stats():
+        if s['refreshes']:
+            avg = "{:.3f}".format(s['refreshTime'] / s['refreshes'])
+        else:
+            avg = "-"
+        print(fmt.format(
+            s['name'], s['entries'], s['bytes'], s['ttl'], s['hits'],
+            s['staleHits'], s['misses'], s['refreshes'], avg))
+
+
+def print_api_trace():
+    """Print a table of traced API calls (see --trace-api), one line per command."""
+    if not isinstance(rClient, api_trace.TracingClient):
+        print(c.yellow("API tracing not enabled (see --trace-api)"))
+        return
+    fmt = "{:<50} {:>6} {:>8} {:>7} {:>6} {:>4} {:>10} {:>8}"
+    print(c.BOLD(fmt.format(
+        "COMMAND", "CALLS", "REQUESTS", "RETRIES", "ERRORS", "429S", "BYTES", "SEC")))
+    for t in rClient.get_summary():
+        print(fmt.format(
+            t['command'][-50:], t['calls'], t['requests'], t['retries'],
+            t['errors'], t['throttled'], t['bytes'], "{:.3f}".format(t['sec'])))
 
 
 def launch_directsdk_shell(scriptFile=None, allowScriptedInput=True):
@@ -95,6 +229,8 @@ def launch_directsdk_shell(scriptFile=None, allowScriptedInput=True):
         print(json.dumps(jsonInput, indent=4))
     def P(jsonInput):
         pager(json.dumps(jsonInput, indent=4))
+    S = print_cache_stats
+    T = print_api_trace
     import readline, code
     r = rClient
     R = rCache
@@ -109,7 +245,10 @@ def launch_directsdk_shell(scriptFile=None, allowScriptedInput=True):
               R = rCache = ravello_cache.RavelloCache()
               c = string_ops
               p(): print(json.dumps(jsonInput, indent=4))
-              P(): pager(json.dumps(jsonInput, indent=4))"""), file=stderr)
+              P(): pager(json.dumps(jsonInput, indent=4))
+              S(): print rCache hit/miss/refresh statistics
+              T(): print per-command totals of traced API calls (r.records
+                   holds the individual calls; see --trace-api)"""), file=stderr)
     shell = code.InteractiveConsole(vars)
     if scriptFile or allowScriptedInput:
         cmds = cfg.opts.cmdlineArgs
@@ -133,7 +272,7 @@ def launch_directsdk_shell(scriptFile=None, allowScriptedInput=True):
 
 def main():
     # Set aside globals that will be used for code-clarity
-    global rOpt, user, appnamePrefix, rClient, rCache, rootNode
+    global rOpt, user, appnamePrefix, rClient, rCache, rootNode, completer
     rOpt = cfg.opts
     user = cfg.user
     if user:
@@ -142,6 +281,7 @@ def main():
         appnamePrefix = ''
     rClient = cfg.rClient
     rCache = cfg.rCache
+    completer = completion.Completer(rCache)
     if rOpt.directsdk:
         launch_directsdk_shell()
         exit()
@@ -175,6 +315,8 @@ def main():
         print("If problem persists, send this message with below traceback to rsaw@redhat.com\n", file=stderr)
         raise
     c.verbose("Done!\n", file=stderr)
+    if is_admin() and rOpt.refreshAll:
+        rootNode.refresh_all()
     # For some reason sleep is necessary here to fix issue #49
     sleep(0.1)
     if not is_admin():
@@ -355,7 +497,7 @@ def get_vm_access_details(vm):
     vnc = ''
     if vm['state'] in ['STARTED']:
         try:
-            vnc = rClient.get_vnc_url(vm['applicationId'], vm['id'])
+            vnc = rCache.get_vnc_url(vm['applicationId'], vm['id'])
         except:
             pass
         else:
@@ -383,8 +525,66 @@ class RavelloRoot(ConfigNode):
             # Images(self)
             Shared(self)
             Keypairs(self)
+            Cache(self)
         else:
             self.ui_command_directsdk_shell = None
+            self.ui_command_refresh_all = None
+    
+    def refresh_all(self, maxThreads=cfg.defaultRefreshAllThreads):
+        """Refresh cfg.refreshAllNodes subtrees, at most *maxThreads* at a time."""
+        jobs = Queue()
+        for name in cfg.refreshAllNodes:
+            try:
+                jobs.put(self.get_child(name))
+            except ValueError:
+                pass
+        printLock = Lock()
+        # So that traced API calls made by workers count toward refresh_all
+        command = getattr(rClient, 'get_command', lambda: None)()
+        def worker():
+            while True:
+                try:
+                    node = jobs.get_nowait()
+                except Empty:
+                    return
+                start = time()
+                try:
+                    # The user is waiting on this, unlike other worker threads
+                    with rate_limit.priority(rate_limit.INTERACTIVE), \
+                            api_trace.attribute_to(rClient, command):
+                        node.refresh()
+                except Exception as e:
+                    with printLock:
+                        print(c.red("  {:<12} FAILED after {:.1f}s: {}".format(node.name, time() - start, e)))
+                else:
+                    with printLock:
+                        print("  {:<12} {} in {:.1f}s".format(node.name, c.green("DONE"), time() - start))
+        print(c.yellow("\nRefreshing {} subtrees, up to {} at a time . . .".format(jobs.qsize(), maxThreads)))
+        stdout.flush()
+        start = time()
+        workers = [Thread(target=worker) for i in range(min(maxThreads, jobs.qsize()))]
+        for t in workers:
+            t.daemon = True
+            t.start()
+        for t in workers:
+            # Joining w/timeout keeps Ctrl-c working
+            while t.is_alive():
+                t.join(0.5)
+        print(c.green("All done in {:.1f}s\n".format(time() - start)))
+    
+    def ui_command_refresh_all(self, maxThreads=cfg.defaultRefreshAllThreads):
+        """
+        Refresh apps, blueprints, users, events, shared & keypairs at once.
+        
+        Optionally specify *maxThreads* to change how many subtrees are
+        refreshed at the same time (default: defaultRefreshAllThreads). This
+        can also be done at startup by use of the --refresh-all cmdline option.
+        """
+        maxThreads = self.ui_eval_param(maxThreads, 'number', cfg.defaultRefreshAllThreads)
+        if maxThreads < 1:
+            print(c.red("\nmaxThreads must be at least 1!\n"))
+            return
+        self.refresh_all(maxThreads)
     
     def summary(self):
         if is_admin():
@@ -403,6 +603,8 @@ class RavelloRoot(ConfigNode):
           c = string_ops
           p(): print(json.dumps(jsonInput, indent=4))
           P(): pager(json.dumps(jsonInput, indent=4))
+          S(): print rCache hit/miss/refresh statistics
+          T(): print per-command totals of traced API calls (see --trace-api)
         
         For help on the SDK, execute help(r) from the shell or consult:
         https://github.com/ravello/python-sdk/blob/master/lib/ravello_sdk.py
@@ -425,6 +627,113 @@ class RavelloRoot(ConfigNode):
             return []
 
 
+class Cache(ConfigNode):
+    """Setup the 'cache' node.
+    
+    Path: /cache/
+    """
+    
+    def __init__(self, parent):
+        ConfigNode.__init__(self, 'cache', parent)
+    
+    def summary(self):
+        hits = misses = entries = 0
+        for s in rCache.get_stats():
+            hits += s['hits'] + s['staleHits']
+            misses += s['misses']
+            entries += s['entries']
+        if hits + misses:
+            return ("{} entries, {:.0%} hit rate over {} reads"
+                    .format(entries, float(hits) / (hits + misses), hits + misses), None)
+        else:
+            return ("{} entries, no reads yet".format(entries), None)
+    
+    def ui_command_stats(self, reset='false'):
+        """
+        Print hit/miss/refresh counters for each type of cached object.
+        
+        HITS are reads served from fresh data; STALE are reads served from
+        expired data while it was revalidated in the background; MISSES are
+        reads that had to wait for an API call. REFRESHES counts API calls made
+        to fill the cache & AVG SEC is their average duration. BYTES is an
+        approximation of the json size of what's currently held.
+        
+        Use reset=true to zero all counters after printing.
+        """
+        reset = self.ui_eval_param(reset, 'bool', False)
+        print()
+        print_cache_stats()
+        if reset:
+            rCache.reset_stats()
+        print()
+    
+    def ui_complete_stats(self, parameters, text, current_param):
+        if current_param == 'reset':
+            completions = [a for a in ['false', 'true']
+                           if a.startswith(text)]
+        else:
+            completions = []
+        if len(completions) == 1:
+            return [completions[0] + ' ']
+        else:
+            return completions
+    
+    def ui_command_purge(self, resourceType='@all'):
+        """
+        Throw away cached objects of one type (or all types).
+        
+        Next access of each purged type will fetch it from Ravello again.
+        """
+        resourceType = self.ui_eval_param(resourceType, 'string', '@all')
+        if resourceType == '@all':
+            resourceType = None
+        elif resourceType not in rCache.resourceTypes:
+            print(c.RED("\nInvalid resourceType!\n"))
+            return
+        rCache.purge(resourceType)
+        print(c.green("\nPurged {}\n".format(resourceType or "all cached objects")))
+    
+    def ui_complete_purge(self, parameters, text, current_param):
+        if current_param == 'resourceType':
+            completions = [a for a in ['@all'] + list(rCache.resourceTypes)
+                           if a.startswith(text)]
+        else:
+            completions = []
+        if len(completions) == 1:
+            return [completions[0] + ' ']
+        else:
+            return completions
+    
+    def ui_command_warm(self, resourceType='@all'):
+        """
+        Fetch collections (bps, users, shares, etc) that aren't already fresh.
+        
+        Individual application aspects can't be warmed; they're fetched as
+        each app is viewed.
+        """
+        resourceType = self.ui_eval_param(resourceType, 'string', '@all')
+        if resourceType == '@all':
+            resourceType = None
+        elif resourceType not in rCache.collectionTypes:
+            print(c.RED("\nInvalid resourceType!\n"))
+            return
+        print(c.yellow("\nWarming cache . . . "), end='')
+        stdout.flush()
+        rCache.warm(resourceType)
+        print(c.green("DONE!\n"))
+    
+    def ui_complete_warm(self, parameters, text, current_param):
+        if current_param == 'resourceType':
+            completions = [a for a in ['@all'] + list(rCache.collectionTypes)
+                           if a.startswith(text)]
+        else:
+            completions = []
+        if len(completions) == 1:
+            return [completions[0] + ' ']
+        else:
+            return completions
+
+
 class Events(ConfigNode):
     """Setup the 'events' node.
     
@@ -445,7 +754,7 @@ class Events(ConfigNode):
         self._children = set([])
         rCache.update_user_cache()
         self.numberOfEvents = self.numberOfRegisteredEvents = 0
-        for eventName in rClient.get_events():
+        for eventName in rCache.get_event_names():
             Event("%s" % eventName.swapcase(), self)
         self.isPopulated = True
     
@@ -462,7 +771,7 @@ class Events(ConfigNode):
     
     def print_event_names(self):
         pager("JSON list of EVENT NAMES\n" +
-              ui.prettify_json(rClient.get_events()))
+              ui.prettify_json(rCache.get_event_names()))
     
     def ui_command_print_event_names(self, outputFile='@EDITOR'):
         """
@@ -480,7 +789,7 @@ class Events(ConfigNode):
         print()
         outputFile = self.ui_eval_param(outputFile, 'string', '@EDITOR')
         description = "list of event names"
-        ui.print_obj(rClient.get_events(), description, outputFile, tmpPrefix='events')
+        ui.print_obj(rCache.get_event_names(), description, outputFile, tmpPrefix='events')
     
     def ui_complete_print_event_names(self, parameters, text, current_param):
         if current_param == 'outputFile':
@@ -557,11 +866,9 @@ class Event(ConfigNode):
         if userEmail == '@moi':
             userId = None
         else:
-            # The following conditionally updates the cache and returns None
-            rCache.get_user()
-            for userId in rCache.userCache:
-                if not userId == '_timestamp' and rCache.userCache[userId]['email'] == userEmail:
-                    break
+            u = rCache.get_user_by_email(userEmail)
+            if u:
+                userId = u['id']
             else:
                 print(c.RED("No Ravello user on your account with that email!\n"))
                 return
@@ -578,19 +885,11 @@ class Event(ConfigNode):
     
     def ui_complete_register(self, parameters, text, current_param):
         if current_param == 'userEmail':
-            rCache.get_user()
-            L = []
-            for userId in rCache.userCache:
-                if not userId == '_timestamp':
-                    L.append(rCache.userCache[userId]['email'])
-            completions = [a for a in L
-                           if a.startswith(text)]
-        else:
-            completions = []
-        if len(completions) == 1:
-            return [completions[0] + ' ']
+            return completer.complete(
+                'userEmails', text, ['users'],
+                lambda: [u['email'] for u in rCache.get_users()])
         else:
-            return completions
+            return []
 
 
 class UserAlert(ConfigNode):
@@ -1134,10 +1433,15 @@ class Users(ConfigNode):
             return ("To populate, run: refresh", False)
     
     def refresh(self):
-        self._children = set([])
         self.numberOfUsers = self.numberOfAdmins = 0
-        for user in rCache.get_users():
-            User(c.replace_bad_chars_with_underscores(user['email']), self, user['id'])
+        users = rCache.get_users()
+        reconcile_children(
+            self, users, 'userId',
+            lambda u: c.replace_bad_chars_with_underscores(u['email']),
+            lambda u: User(c.replace_bad_chars_with_underscores(u['email']), self, u['id']),
+            lambda child, u: child.refresh())
+        self.numberOfUsers = len(self._children)
+        for user in users:
             if 'ADMIN' in user['roles']:
                 self.numberOfAdmins += 1
         self.isPopulated = True
@@ -1174,6 +1478,7 @@ class Users(ConfigNode):
             print(c.red("Problem inviting user\n!"))
             raise
         print(c.green("Invited user {}\n".format(req['email'])))
+        rCache.userCache[user['id']] = user
         User("%s" % user['email'], self, user['id'])
 
 
@@ -1220,7 +1525,7 @@ class User(ConfigNode):
         print()
         outputFile = self.ui_eval_param(outputFile, 'string', '@EDITOR')
         description = "user definition for /users/{}".format(self.user)
-        ui.print_obj(rCache.get_user(self.userId), description, outputFile,
+        ui.print_obj(rClient.get_user(self.userId), description, outputFile,
             tmpPrefix='user_{}'.format(self.user))
     
     def ui_complete_print_def(self, parameters, text, current_param):
@@ -1301,6 +1606,7 @@ class User(ConfigNode):
             if admin:
                 self.parent.numberOfAdmins -= 1
             print(c.green("Deleted user {}\n".format(userEmail)))
+            rCache.purge_user_cache(self.userId)
             self.parent.remove_child(self)
         else:
             print("Leaving user intact (probably a good choice)\n")
@@ -1346,14 +1652,26 @@ class Blueprints(ConfigNode):
     
     def refresh(self):
         rCache.update_bp_cache()
-        self._children = set([])
-        sharedWithMe = SharedBps(self)
-        self.numberOfBps = self.numberOfLearnerBps = 0
+        try:
+            sharedWithMe = self.get_child('Shared_with_me')
+        except ValueError:
+            sharedWithMe = SharedBps(self)
+        myBps = []
+        sharedBps = []
         for bp in rCache.get_bps():
             if rCache.get_user(bp['ownerDetails']['userId']):
-                Bp(bp, self)
+                myBps.append(bp)
             else:
-                Bp(bp, sharedWithMe)
+                sharedBps.append(bp)
+        for node, bps in ((self, myBps), (sharedWithMe, sharedBps)):
+            node.numberOfBps = node.numberOfLearnerBps = 0
+            reconcile_children(
+                node, bps, 'bpId', lambda bp: bp['name'],
+                lambda bp, node=node: Bp(bp, node),
+                lambda child, bp: child.update(bp))
+            bpNodes = [child for child in node._children if isinstance(child, Bp)]
+            node.numberOfBps = len(bpNodes)
+            node.numberOfLearnerBps = len([b for b in bpNodes if b.isLearnerBp])
         self.isPopulated = True
     
     def ui_command_refresh(self):
@@ -1393,20 +1711,24 @@ class Bp(ConfigNode):
     def __init__(self, bp, parent):
         ConfigNode.__init__(self, bp['name'], parent)
         parent.numberOfBps += 1
-        self.bp = bp
         self.bpName = bp['name']
         self.bpId = bp['id']
+        self.update(bp)
+        if self.isLearnerBp:
+            parent.numberOfLearnerBps += 1
+        if parent != rootNode.get_child('blueprints'):
+            # If we are a shared blueprint
+            self.ui_command_delete = None
+            self.ui_command_find_pub_locations = None
+    
+    def update(self, bp):
+        """Update node from blueprint *bp*, e.g. after a refresh."""
         self.bpOwner = bp['owner']
         self.creationTime = datetime.fromtimestamp(int(str(bp['creationTime'])[:-3]))
         if 'description' in bp and any(tag in bp['description'] for tag in cfg.learnerBlueprintTag):
             self.isLearnerBp = True
-            parent.numberOfLearnerBps += 1
         else:
             self.isLearnerBp = False
-        if parent != rootNode.get_child('blueprints'):
-            # If we are a shared blueprint
-            self.ui_command_delete = None
-            self.ui_command_find_pub_locations = None
     
     def summary(self):
         if self.creationTime.year == datetime.now().year:
@@ -1443,6 +1765,7 @@ class Bp(ConfigNode):
                 print(c.red("Problem deleting blueprint!\n"))
                 raise
             print(c.green("Deleted blueprint {}\n".format(self.bpName)))
+            rCache.purge_bp_cache(self.bpId)
             self.parent.remove_child(self)
             self.parent.numberOfBps -= 1
         else:
@@ -1472,19 +1795,7 @@ class Bp(ConfigNode):
         print()
         outputFile = self.ui_eval_param(outputFile, 'string', '@EDITOR')
         description = "BP available publish locations for /blueprints/{}".format(self.bpName)
-        pubLocations = [r for r in rClient.get_blueprint_publish_locations(self.bpId)
-                        if not r['deprecated']]
-        # BMC blueprint?
-        bpDescription = rCache.get_bp(self.bpId).get('description')
-        # Remove bmc regions or remove everything BUT bmc regions
-        if bpDescription and any(tag in bpDescription for tag in cfg.bmcBlueprintTag):
-            # Is BMC blueprint
-            pubLocations = [r for r in pubLocations
-                            if r['regionName'] in cfg.bmcRegionNames]
-        else:
-            # Is not BMC blueprint
-            pubLocations = [r for r in pubLocations
-                            if not r['regionName'] in cfg.bmcRegionNames]
+        pubLocations = rCache.get_pub_locations(bpId=self.bpId)
         ui.print_obj(pubLocations,
             description, outputFile, tmpPrefix='publoc_{}'.format(self.bpName))
     
@@ -1533,7 +1844,7 @@ class Bp(ConfigNode):
             else:
                 newBpName = self.bpName
         elif name == '@auto':
-            newBpName = ravello_sdk.new_name(rCache.get_bps(myOrgOnly=True), self.bpName + '_')
+            newBpName = ravello_sdk.new_name([bp['name'] for bp in rCache.get_bps(myOrgOnly=True)], self.bpName + '_')
         else:
             newBpName = name
         # Prompt for description if necessary
@@ -1558,17 +1869,17 @@ class Bp(ConfigNode):
             print(c.red("\nProblem creating new blueprint!\n"))
             raise
         print(c.green("\nSUCCESS! New blueprint '{}' created!".format(newBpName)))
+        rCache.bpCache[newBp['id']] = newBp
         # Add new bp to directory tree
         Bp(newBp, rootNode.get_child('blueprints'))
         print()
     
     def ui_complete_copy(self, parameters, text, current_param):
         if current_param == 'name':
-            L = ['@prompt', '@auto']
-            for bp in rCache.get_bps():
-                L.append(bp['name'])
-            completions = [a for a in L
-                           if a.startswith(text)]
+            return completer.complete(
+                'bpNames', text, ['bps'],
+                lambda: [bp['name'] for bp in rCache.get_bps()],
+                fixed=['@prompt', '@auto'])
         elif current_param == 'desc':
             completions = [a for a in ['@prompt', '@auto']
                            if a.startswith(text)]
@@ -1591,9 +1902,57 @@ class Applications(ConfigNode):
         self.numberOfApps = 0
         self.numberOfPublishedApps = 0
         self.isPopulated = False
+        # Number of active VMs per appId; kept up to date by our own actions
+        # and re-derived from the cached app list whenever it's reloaded
+        self.activeVms = {}
+        self._reconcileTimestamp = 0
+        self._reconcileRequested = 0
+    
+    def is_listed(self, appName):
+        """Return True if app *appName* belongs under this node."""
+        return is_admin() and rOpt.showAllApps or appName.startswith(appnamePrefix)
+    
+    def get_node_name(self, app):
+        if is_admin() and rOpt.showAllApps:
+            return app['name']
+        else:
+            return app['name'].replace(appnamePrefix, '')
+    
+    def set_active_vms(self, appId, number):
+        self.activeVms[appId] = number
+    
+    def adjust_active_vms(self, appId, delta):
+        self.activeVms[appId] = max(0, self.activeVms.get(appId, 0) + delta)
+    
+    def reconcile(self):
+        """Re-derive counters from the cached app list if it's newer than them.
+        
+        This never blocks on the API: if the cached list is stale, a reload is
+        started in the background & picked up by a later call.
+        """
+        b = rCache.appListCache
+        tstamp = b.tstamp
+        if tstamp and tstamp > self._reconcileTimestamp:
+            activeVms = {}
+            numberOfPublishedApps = 0
+            for app in b.values():
+                if not self.is_listed(app['name']):
+                    continue
+                if app.get('published'):
+                    numberOfPublishedApps += 1
+                activeVms[app['id']] = app.get('deployment', {}).get('totalActiveVms', 0)
+            self.activeVms = activeVms
+            self.numberOfPublishedApps = numberOfPublishedApps
+            self._reconcileTimestamp = tstamp
+        if not b.is_loaded() and time() - self._reconcileRequested > b.ttl:
+            self._reconcileRequested = time()
+            rCache.prefetch(['appList'])
+    
+    def get_active_vms(self):
+        self.reconcile()
+        return sum(self.activeVms.values())
     
     def refresh(self, appName=None):
-        rCache.purge_app_cache()
         # If we were passed a specific app ...
         if appName:
             # In case of -A, expect appName to be full name
@@ -1613,28 +1972,37 @@ class Applications(ConfigNode):
             except:
                 pass
             # Try to get the app
-            app = rClient.get_application_by_name(appName)
+            app = rCache.get_app_by_name(appName)
+            # Only this app needs re-fetching, not all of them
+            rCache.purge_app_cache(app['id'])
             # If we're still here, create the node & increment counters
             App(nodeName, self, app['id'])
             if app['published']:
                 self.numberOfPublishedApps += 1
+            self.set_active_vms(app['id'], app.get('deployment', {}).get('totalActiveVms', 0))
         # If no app, then, let's do everything
         else:
-            self._children = set([])
-            self.numberOfApps = 0
+            rCache.purge_app_cache()
             self.numberOfPublishedApps = 0
-            for app in rClient.get_applications():
-                if is_admin() and rOpt.showAllApps:
-                    nodeName = app['name']
-                elif app['name'].startswith(appnamePrefix):
-                    nodeName = app['name'].replace(appnamePrefix, '')
-                else:
+            self.activeVms = {}
+            rCache.update_app_list_cache()
+            apps = []
+            for app in rCache.get_app_list():
+                if not self.is_listed(app['name']):
                     # Not one of our apps, so skip it
                     continue
-                # Create the node and increment counters
-                App(nodeName, self, app['id'])
+                apps.append(app)
                 if app['published']:
                     self.numberOfPublishedApps += 1
+                self.set_active_vms(app['id'], app.get('deployment', {}).get('totalActiveVms', 0))
+            # Only add/remove nodes for apps that came or went; the VMs of
+            # the rest are re-read next time they're listed
+            reconcile_children(
+                self, apps, 'appId', self.get_node_name,
+                lambda app: App(self.get_node_name(app), self, app['id']),
+                lambda child, app: child.get_child('vms').reset())
+            self.numberOfApps = len(self._children)
+            self._reconcileTimestamp = rCache.appListCache.tstamp or 0
             self.isPopulated = True
     
     def summary(self):
@@ -1707,7 +2075,7 @@ class Applications(ConfigNode):
             print()
         if noconfirm or response == 'YES!':
             rCache.purge_app_cache()
-            for app in rClient.get_applications():
+            for app in rCache.get_applications(appnamePrefix):
                 if app['name'].startswith(appnamePrefix):
                     appName = app['name'].replace(appnamePrefix, '')
                     try:
@@ -1762,14 +2130,7 @@ class Applications(ConfigNode):
         allowExactName = self.ui_eval_param(allowExactName, 'bool', False)
         
         # Check for available blueprints first
-        allowedBlueprints = []
-        for bp in rCache.get_bps(myOrgOnly=True):
-            try:
-                description = bp['description']
-            except:
-                description = ''
-            if is_admin() or any(tag in description for tag in cfg.learnerBlueprintTag) or '#{}{}'.format(cfg.appnameNickPrefix, user) in description:
-                allowedBlueprints.append(bp['name'])
+        allowedBlueprints = [bp['name'] for bp in get_allowed_blueprints()]
         if not allowedBlueprints:
             print(c.red("\nThere are no blueprints available for you to base an application on!\n"))
             return
@@ -1788,15 +2149,13 @@ class Applications(ConfigNode):
             baseBlueprintName = blueprint
             
         # Quit if invalid blueprint name
-        if baseBlueprintName not in allowedBlueprints or not ui.iterate_json_keys_for_value(rCache.get_bps(myOrgOnly=True), 'name', baseBlueprintName):
+        bp = rCache.get_bp_by_name(baseBlueprintName)
+        if baseBlueprintName not in allowedBlueprints or not bp:
             print(c.RED("\nInvalid blueprint name!\n"))
             return
         
         # Convert blueprint name to id
-        for bp in rCache.get_bps(myOrgOnly=True):
-            if bp['name'] == baseBlueprintName:
-                baseBlueprintId = bp['id']
-                break
+        baseBlueprintId = bp['id']
         
         if name == '@prompt' or name == '@auto':
             # Set default app name based off blueprint name
@@ -1824,7 +2183,7 @@ class Applications(ConfigNode):
         
         # Ensure there's not already an app with that name
         if not allowExactName:
-            appName = ravello_sdk.new_name(rClient.get_applications(), appName + '_')
+            appName = ravello_sdk.new_name([a['name'] for a in rCache.get_app_list()], appName + '_')
         
         if desc == '@prompt':
             # Prompt for description
@@ -1850,6 +2209,7 @@ class Applications(ConfigNode):
         except:
             print(c.red("\nProblem creating application!\n"))
             raise
+        rCache.appListCache[newApp['id']] = newApp
         
         # Strip appname prefix for purposes of our UI
         if not rOpt.showAllApps:
@@ -1870,17 +2230,10 @@ class Applications(ConfigNode):
     
     def ui_complete_new(self, parameters, text, current_param):
         if current_param == 'blueprint':
-            allowedBlueprints = ['@prompt']
-            blueprints = rCache.get_bps(myOrgOnly=True)
-            for bp in blueprints:
-                try:
-                    description = bp['description']
-                except:
-                    description = ''
-                if is_admin() or any(tag in description for tag in cfg.learnerBlueprintTag) or '#{}{}'.format(cfg.appnameNickPrefix, user) in description:
-                    allowedBlueprints.append(bp['name'])
-            completions = [a for a in allowedBlueprints
-                           if a.startswith(text)]
+            return completer.complete(
+                'allowedBpNames', text, ['bps', 'users'],
+                lambda: [bp['name'] for bp in get_allowed_blueprints()],
+                fixed=['@prompt'])
         elif current_param in ['name', 'desc']:
             completions = [a for a in ['@prompt', '@auto']
                            if a.startswith(text)]
@@ -1896,40 +2249,23 @@ class Applications(ConfigNode):
                                if a.startswith(text)]
             else:
                 allowedBlueprints = {}
-                blueprints = rCache.get_bps(myOrgOnly=True)
-                for bp in blueprints:
-                    try:
-                        description = bp['description']
-                    except:
-                        description = ''
-                    if is_admin() or any(tag in description for tag in cfg.learnerBlueprintTag) or '#{}{}'.format(cfg.appnameNickPrefix, user) in description:
-                        allowedBlueprints[bp['name']] = bp['id']
+                for bp in get_allowed_blueprints():
+                    allowedBlueprints[bp['name']] = bp['id']
                 try:
                     bpId = allowedBlueprints[blueprint]
                 except:
                     completions = [a for a in L
                                    if a.startswith(text)]
                 else:
-                    pubLocations = [r for r in rClient.get_blueprint_publish_locations(bpId)
-                                    if not r['deprecated']]
-                    # BMC blueprint?
-                    bpDescription = rCache.get_bp(bpId).get('description')
-                    # Remove bmc regions or remove everything BUT bmc regions
-                    if bpDescription and any(tag in bpDescription for tag in cfg.bmcBlueprintTag):
-                        # Is BMC blueprint
-                        pubLocations = [r for r in pubLocations
-                                        if r['regionName'] in cfg.bmcRegionNames]
-                    else:
-                        # Is not BMC blueprint
-                        pubLocations = [r for r in pubLocations
-                                        if not r['regionName'] in cfg.bmcRegionNames]
                     # Somewhat ironically, we only add cost-optimized option for admins
                     if is_admin():
-                        pubLocations.insert(0, {'regionName': "@auto", 'regionDisplayName': "@auto"})
-                    for p in pubLocations:
-                        L.append(p['regionDisplayName'].replace(" ", "-"))
-                    completions = [a for a in L
-                                   if a.startswith(text)]
+                        L.append('@auto')
+                    return completer.complete(
+                        ('bpRegions', bpId), text,
+                        ['bps', ('pubLocations', rCache.get_pub_locations_key(bpId=bpId))],
+                        lambda: [p['regionDisplayName'].replace(" ", "-")
+                                 for p in rCache.get_pub_locations(bpId=bpId)],
+                        fixed=L)
         else:
             completions = []
         if len(completions) == 1:
@@ -1955,7 +2291,7 @@ class App(ConfigNode):
         Vms(self)
     
     def summary(self):
-        app = rCache.get_app(self.appId)
+        app = rCache.get_app_summary(self.appId)
         owner = app['owner']
         _date = ui.convert_ts_to_date(app['creationTime'], showHours=False)
         try:
@@ -1968,9 +2304,15 @@ class App(ConfigNode):
         except:
             note = ""
         if app['published']:
-            region = app['deployment']['regionName'].replace(" ", "-")
-            totalErrorVms = app['deployment']['totalErrorVms']
-            appState = ravello_sdk.application_state(app)
+            region = app['deployment'].get('regionName', 'unknown region').replace(" ", "-")
+            totalErrorVms = app['deployment'].get('totalErrorVms', 0)
+            if 'vms' in app['deployment']:
+                appState = ravello_sdk.application_state(app)
+            elif app['deployment'].get('totalActiveVms'):
+                # App list entries only have VM totals, not per-VM states
+                appState = 'STARTED'
+            else:
+                appState = 'STOPPED'
             if isinstance(appState, list):
                 if 'STOPPING' in appState:
                     hazHappy = False
@@ -2006,7 +2348,7 @@ class App(ConfigNode):
         print(c.BOLD("    /apps/{}/ publish\n".format(self.appName)))
     
     def confirm_app_is_published(self, quiet=False):
-        published = rClient.is_application_published(self.appId)['value']
+        published = rCache.get_app_status(self.appId)['published']
         if not (published or quiet):
             self.print_message_app_not_published()
         return published
@@ -2146,7 +2488,8 @@ class App(ConfigNode):
                 i -= 1
             if not quiet:
                 print()
-            app = rClient.get_application(self.appId, aspect='deployment')
+            with rate_limit.priority(rate_limit.POLLING):
+                app = rClient.get_application(self.appId, aspect='deployment')
             if app['published']:
                 if desiredState == 'STARTED':
                     groupsNoAutostart = [g['id'] for g in app['deployment']['vmOrderGroups'] if g.get('skipStartupSequence', False)]
@@ -2215,7 +2558,7 @@ class App(ConfigNode):
             - VNC web URLs
         """
         print()
-        app = rClient.get_application(self.appId, aspect='deployment')
+        app = rCache.get_app_status(self.appId)
         self.query_status(app)
     
     def query_status(self, app):
@@ -2266,7 +2609,7 @@ class App(ConfigNode):
             raise
         print(c.green("\nApp auto-stop set for {} minutes from now"
                       .format(minutes)))
-        rCache.purge_app_cache(self.appId)
+        rCache.purge_app_cache(self.appId, aspect='deployment')
     
     def ui_command_extend_autostop(self, minutes=cfg.defaultAppExtendTime):
         """
@@ -2377,7 +2720,7 @@ class App(ConfigNode):
         allowExactName = self.ui_eval_param(allowExactName, 'bool', False)
         quiet = self.ui_eval_param(quiet, 'bool', False)
         force = self.ui_eval_param(force, 'bool', False)
-        bpName = c.replace_bad_chars_with_underscores(rCache.get_app(self.appId)['name'])
+        bpName = c.replace_bad_chars_with_underscores(rCache.get_app(self.appId, aspect='properties')['name'])
         if name == '@prompt':
             a = raw_input(c.CYAN("\nEnter a name for the new blueprint [{}]: ".format(bpName)))
             if len(a):
@@ -2398,7 +2741,7 @@ class App(ConfigNode):
         tagCreatedWithByFrom = "[Created w/{} {} by {} from app '{}']".format(cfg.prog, cfg.__version__, user, self.appName)
         # Ensure there's not already a bp with that name
         if not allowExactName:
-            name = ravello_sdk.new_name(rCache.get_bps(myOrgOnly=True), name + '_')
+            name = ravello_sdk.new_name([bp['name'] for bp in rCache.get_bps(myOrgOnly=True)], name + '_')
         if desc == '@prompt':
             desc = raw_input(c.CYAN("\nOptionally enter a description for your new app: "))
             if len(desc):
@@ -2406,7 +2749,7 @@ class App(ConfigNode):
             else:
                 desc = tagCreatedWithByFrom
         elif desc == '@auto':
-            desc = rCache.get_app(self.appId)['description']
+            desc = rCache.get_app(self.appId, aspect='properties')['description']
         else:
             desc += " {}".format(tagCreatedWithByFrom)
         # Wait for all VMs to get to one consolidated state (i.e., STARTED or STOPPED).
@@ -2541,20 +2884,7 @@ class App(ConfigNode):
         print()
         outputFile = self.ui_eval_param(outputFile, 'string', '@EDITOR')
         description = "APP available publish locations for /apps/{}".format(self.appName)
-        pubLocations = [r for r in rClient.get_application_publish_locations(self.appId)
-                        if not r['deprecated']]
-        # BMC blueprint?
-        bpId = rCache.get_app(self.appId)['baseBlueprintId']
-        bpDescription = rCache.get_bp(bpId).get('description')
-        # Remove bmc regions or remove everything BUT bmc regions
-        if bpDescription and any(tag in bpDescription for tag in cfg.bmcBlueprintTag):
-            # Is BMC blueprint
-            pubLocations = [r for r in pubLocations
-                            if r['regionName'] in cfg.bmcRegionNames]
-        else:
-            # Is not BMC blueprint
-            pubLocations = [r for r in pubLocations
-                            if not r['regionName'] in cfg.bmcRegionNames]
+        pubLocations = rCache.get_pub_locations(appId=self.appId)
         ui.print_obj(pubLocations,
             description, outputFile, tmpPrefix='publoc_{}'.format(self.appName))
     
@@ -2566,7 +2896,7 @@ class App(ConfigNode):
         cost bucket with name or ID of *costBucket*.
         """
         cb = None
-        buckets = rClient.get_cost_buckets(permissions='execute')
+        buckets = rCache.get_cost_buckets()
         if not buckets:
             print(c.red("Unable to associate app with cost bucket!\n"
                         "Your user doesn't have execute permission on any cost buckets"))
@@ -2621,7 +2951,9 @@ class App(ConfigNode):
                 raise
             if published:
                 self.parent.numberOfPublishedApps -= 1
+            self.parent.activeVms.pop(self.appId, None)
             rCache.purge_app_cache(self.appId)
+            rCache.purge_app_list_cache(self.appId)
             self.parent.numberOfApps -= 1
             print(c.green("Deleted application {}".format(self.appName)))
             self.parent.remove_child(self)
@@ -2687,20 +3019,7 @@ class App(ConfigNode):
                 print(c.BOLD("    /apps/{}/ start\n".format(self.appName)))
                 return
         # Choosing time
-        pubLocations = [r for r in rClient.get_application_publish_locations(self.appId)
-                        if not r['deprecated']]
-        # Determine whether this app came from a BMC blueprint
-        bpId = rCache.get_app(self.appId)['baseBlueprintId']
-        bpDescription = rCache.get_bp(bpId).get('description')
-        # Remove bmc regions or remove everything BUT bmc regions
-        if bpDescription and any(tag in bpDescription for tag in cfg.bmcBlueprintTag):
-            # Is BMC blueprint
-            pubLocations = [r for r in pubLocations
-                            if r['regionName'] in cfg.bmcRegionNames]
-        else:
-            # Is not BMC blueprint
-            pubLocations = [r for r in pubLocations
-                            if not r['regionName'] in cfg.bmcRegionNames]
+        pubLocations = rCache.get_pub_locations(appId=self.appId)
         # Somewhat ironically, we only add cost-optimized option for admins
         if is_admin():
             pubLocations.insert(0, {'regionName': "@auto", 'regionDisplayName': "@auto"})
@@ -2744,6 +3063,7 @@ class App(ConfigNode):
         print(c.yellow("\nRavello now publishing your application (Could take a while)"))
         # Configure auto-stop
         if startAllVms:
+            self.parent.set_active_vms(self.appId, self.get_number_of_vms())
             self.extend_autostop(minutes=cfg.defaultAppExpireTime)
             if loopQueryStatus:
                 self.loop_query_status(desiredState='STARTED')
@@ -2754,27 +3074,15 @@ class App(ConfigNode):
     def ui_complete_publish(self, parameters, text, current_param):
         if current_param == 'region':
             L = ['@prompt']
-            pubLocations = [r for r in rClient.get_application_publish_locations(self.appId)
-                            if not r['deprecated']]
-            # Determine whether this app came from a BMC blueprint
-            bpId = rCache.get_app(self.appId)['baseBlueprintId']
-            bpDescription = rCache.get_bp(bpId).get('description')
-            # Remove bmc regions or remove everything BUT bmc regions
-            if bpDescription and any(tag in bpDescription for tag in cfg.bmcBlueprintTag):
-                # Is BMC blueprint
-                pubLocations = [r for r in pubLocations
-                                if r['regionName'] in cfg.bmcRegionNames]
-            else:
-                # Is not BMC blueprint
-                pubLocations = [r for r in pubLocations
-                                if not r['regionName'] in cfg.bmcRegionNames]
             # Somewhat ironically, we only add cost-optimized option for admins
             if is_admin():
-                pubLocations.insert(0, {'regionName': "@auto", 'regionDisplayName': "@auto"})
-            for p in pubLocations:
-                L.append(p['regionDisplayName'].replace(" ", "-"))
-            completions = [a for a in L
-                           if a.startswith(text)]
+                L.append('@auto')
+            return completer.complete(
+                ('appRegions', self.appId), text,
+                [('pubLocations', rCache.get_pub_locations_key(appId=self.appId))],
+                lambda: [p['regionDisplayName'].replace(" ", "-")
+                         for p in rCache.get_pub_locations(appId=self.appId)],
+                fixed=L)
         elif current_param in ['startAllVms', 'loopQueryStatus']:
             completions = [a for a in ['true', 'false']
                            if a.startswith(text)]
@@ -2836,7 +3144,7 @@ class App(ConfigNode):
             name = a
         # Handle other cases
         if name == '@auto':
-            name = ravello_sdk.new_name(rClient.get_applications(), app['name'] + '_')
+            name = ravello_sdk.new_name([a['name'] for a in rCache.get_app_list()], app['name'] + '_')
         elif append:
             # Only pay attention to append=true if name!=@auto
             name = app['name'] + name
@@ -2863,6 +3171,7 @@ class App(ConfigNode):
         print(c.green("\nApplication renamed to '{}'!{}".format(newName, xtradetails)))
         # Cleanup configshell nodes
         rCache.purge_app_cache(self.appId)
+        rCache.appListCache[newApp['id']] = newApp
         App("%s" % newName, self.parent, newApp['id'])
         self.parent.remove_child(self)
         print()
@@ -2907,7 +3216,8 @@ class App(ConfigNode):
             print(c.red("\nProblem starting application!\n"))
             raise
         print(c.yellow("\nApplication now starting"))
-        rCache.purge_app_cache(self.appId)
+        self.parent.set_active_vms(self.appId, self.get_number_of_vms())
+        rCache.purge_app_cache(self.appId, aspect='deployment')
         if loopQueryStatus:
             self.loop_query_status(desiredState='STARTED')
         else:
@@ -2937,7 +3247,8 @@ class App(ConfigNode):
         except:
             print("\nProblem stopping application!\n")
         print(c.yellow("\nApplication now stopping\n"))
-        rCache.purge_app_cache(self.appId)
+        self.parent.set_active_vms(self.appId, 0)
+        rCache.purge_app_cache(self.appId, aspect='deployment')
     
     def ui_command_restart(self):
         """
@@ -2954,12 +3265,15 @@ class App(ConfigNode):
             print("\nProblem restarting application!\n")
             raise
         print(c.yellow("\nApplication now restarting"))
-        rCache.purge_app_cache(self.appId)
+        rCache.purge_app_cache(self.appId, aspect='deployment')
         self.loop_query_status(desiredState='STARTED')
     
+    def get_number_of_vms(self):
+        return len(rCache.get_app(self.appId, aspect='design')['design'].get('vms', []))
+    
     def generate_images(self):
         """Generate snapshot of all vms in the app. Not ready for primetime."""
-        appDetails = rCache.get_app(self.appId)
+        appDetails = rCache.get_app(self.appId, aspect='design')
         for i in range(len(appDetails['design']['vms'])):
             print("\n Generating snapshot for vm ",appDetails['design']['vms'][i]['name'])
             imageName = c.replace_bad_chars_with_underscores(appDetails['name'])
@@ -2983,17 +3297,43 @@ class Vms(ConfigNode):
     """Setup the dynamically-named vm node.
     
     Path: /apps/{APP_NAME}/vms/
+    
+    Vm child nodes are created the first time they're needed (by ls, cd or
+    tab-completion) rather than when the app node is, to save an API call per
+    app on /apps refresh.
     """
     
     def __init__(self, parent):
         ConfigNode.__init__(self, 'vms', parent)
         self.appId = parent.appId
         self.appName = parent.appName
-        for vm in rClient.get_vms(self.appId):
-            Vm("%s" % vm['name'], self, vm['id'])
+        self.isPopulated = False
+    
+    def populate(self):
+        if self.isPopulated:
+            return
+        app = rCache.get_app(self.appId, aspect='design')
+        reconcile_children(
+            self, app['design'].get('vms', []), 'vmId',
+            lambda vm: "%s" % vm['name'],
+            lambda vm: Vm("%s" % vm['name'], self, vm['id']))
+        self.isPopulated = True
+    
+    def reset(self):
+        """Make the next populate() pick up VMs added, removed or renamed since."""
+        self.isPopulated = False
+    
+    @property
+    def children(self):
+        self.populate()
+        return self._children
+    
+    def get_child(self, name):
+        self.populate()
+        return ConfigNode.get_child(self, name)
     
     def summary(self):
-        app = rCache.get_app(self.appId)
+        app = rCache.get_app(self.appId, aspect='deployment')
         if app['published']:
             totalVms = len(app['deployment']['vms'])
             totalActiveVms = app['deployment']['totalActiveVms']
@@ -3052,7 +3392,7 @@ class Vm(ConfigNode):
             ]
     
     def summary(self):
-        app = rCache.get_app(self.appId)
+        app = rCache.get_app(self.appId, aspect='deployment')
         if app['published']:
             happyStates = ['STARTED', 'STARTING', 'RESTARTING', 'PUBLISHING' ]
             for vm in app['deployment']['vms']:
@@ -3184,7 +3524,8 @@ class Vm(ConfigNode):
                 .format(intervalSec, totalMin)), file=stderr)
         loopCount = 0
         while loopCount <= maxLoops:
-            vm = rClient.get_vm(self.appId, self.vmId, aspect='deployment')
+            with rate_limit.priority(rate_limit.POLLING if loopCount else rate_limit.INTERACTIVE):
+                vm = rCache.get_vm_status(self.appId, self.vmId, fresh=loopCount > 0)
             ssh_fqdn = ssh_port = ssh_key = None
             if not ('networkConnections' in vm or 'suppliedServices' in vm):
                 pass
@@ -3341,7 +3682,8 @@ class Vm(ConfigNode):
                 .format(intervalSec, totalMin)), file=stderr)
         loopCount = 0
         while loopCount <= maxLoops:
-            vm = rClient.get_vm(self.appId, self.vmId, aspect='deployment')
+            with rate_limit.priority(rate_limit.POLLING if loopCount else rate_limit.INTERACTIVE):
+                vm = rCache.get_vm_status(self.appId, self.vmId, fresh=loopCount > 0)
             out, deets = get_vm_access_details(vm)
             if not quiet:
                 print("\n".join(out))
@@ -3424,7 +3766,8 @@ class Vm(ConfigNode):
             print(c.red("\nProblem starting VM!\n"))
             raise
         print(c.yellow("\nVM now starting\n"))
-        rCache.purge_app_cache(self.appId)
+        self.parent.parent.parent.adjust_active_vms(self.appId, 1)
+        rCache.purge_app_cache(self.appId, aspect='deployment')
     
     def ui_command_reset_disks(self):
         """
@@ -3511,7 +3854,8 @@ class Vm(ConfigNode):
             print(c.red("\nProblem stopping VM!\n"))
             raise
         print(c.yellow("\nVM now stopping\n"))
-        rCache.purge_app_cache(self.appId)
+        self.parent.parent.parent.adjust_active_vms(self.appId, -1)
+        rCache.purge_app_cache(self.appId, aspect='deployment')
     
     def ui_command_poweroff(self):
         """
@@ -3531,7 +3875,8 @@ class Vm(ConfigNode):
             print(c.red("\nProblem powering off VM!\n"))
             raise
         print(c.yellow("\nVM should be immediately forced off\n"))
-        rCache.purge_app_cache(self.appId)
+        self.parent.parent.parent.adjust_active_vms(self.appId, -1)
+        rCache.purge_app_cache(self.appId, aspect='deployment')
     
     def ui_command_restart(self):
         """
@@ -3552,7 +3897,7 @@ class Vm(ConfigNode):
             print(c.red("\nProblem restarting VM!\n"))
             raise
         print(c.yellow("\nVM now restarting\n"))
-        rCache.purge_app_cache(self.appId)
+        rCache.purge_app_cache(self.appId, aspect='deployment')
     
     def ui_command_repair(self):
         """
@@ -3570,7 +3915,7 @@ class Vm(ConfigNode):
             print(c.red("\nProblem repairing VM!\n"))
             raise
         print(c.yellow("\nAPI 'repair' call was sent; check VM status\n"))
-        rCache.purge_app_cache(self.appId)
+        rCache.purge_app_cache(self.appId, aspect='deployment')
     
     def ui_command_set_stoptimeout(self, seconds, publishUpdates='true'):
         """
@@ -3683,10 +4028,10 @@ class Vm(ConfigNode):
     
     def ui_complete_cloudinit_keypair(self, parameters, text, current_param):
         if current_param == 'keypair':
-            kpNames = [c.replace_bad_chars_with_underscores(kp['name'])
-                       for kp in rCache.get_keypairs()]
-            completions = [a for a in kpNames
-                           if a.startswith(text)]
+            return completer.complete(
+                'keypairNames', text, ['keypairs'],
+                lambda: [c.replace_bad_chars_with_underscores(kp['name'])
+                         for kp in rCache.get_keypairs()])
         elif current_param == 'publishUpdates':
             completions = [a for a in ['false', 'true']
                            if a.startswith(text)]
@@ -4317,7 +4662,7 @@ class Shared(ConfigNode):
             target = s['targetEmail']
         elif 'targetCommunityId' in s:
             try:
-                community = rClient.get_community(s['targetCommunityId'])
+                community = rCache.get_community(s['targetCommunityId'])
                 target = community['name']
             except:
                 target = "{}".format(s['targetCommunityId'])
@@ -4330,14 +4675,49 @@ class Shared(ConfigNode):
             grandchild = self.nodeToTarget[uid][target] = SharedToTarget(target, child)
         Share(s, grandchild)
     
+    def remove_share_node(self, shareNode):
+        """Remove *shareNode*, along with its parents if they're left empty."""
+        toNode = shareNode.parent
+        fromNode = toNode.parent
+        self.numberOfShares -= 1
+        fromNode.numberOfShares -= 1
+        toNode.numberOfShares -= 1
+        if not fromNode.numberOfShares:
+            # If the sharing user has no more shares, remove everything
+            self.remove_child(fromNode)
+            del self.nodeFromUser[fromNode.uid]
+            self.nodeToTarget.pop(fromNode.uid, None)
+        elif not toNode.numberOfShares:
+            # Or if there are no more resources shared TO the same target, remove that
+            fromNode.remove_child(toNode)
+            fromNode.numberOfTargets -= 1
+            del self.nodeToTarget[fromNode.uid][toNode.target]
+        else:
+            # Otherwise, just remove the share
+            toNode.remove_child(shareNode)
+    
     def refresh(self):
-        self._children = set([])
-        self.numberOfShares = 0
-        self.nodeFromUser = {}
-        self.nodeToTarget = {}
         rCache.update_share_cache()
-        for s in rCache.get_shares():
-            self._integrate_share_into_node_structure(s)
+        shares = rCache.get_shares()
+        # Resource names are resolved from library listings, so that each
+        # share doesn't need its own lookup
+        if any(s['sharedResourceType'] == 'LIBRARY_VM' for s in shares):
+            rCache.update_image_cache()
+        if any(s['sharedResourceType'] == 'DISK_IMAGE' for s in shares):
+            rCache.update_diskimage_cache()
+        shareIds = set(s['id'] for s in shares)
+        # Remove nodes of shares that are gone & leave the rest alone
+        existing = set()
+        for fromNode in list(self._children):
+            for toNode in list(fromNode._children):
+                for shareNode in list(toNode._children):
+                    if shareNode.shareId in shareIds:
+                        existing.add(shareNode.shareId)
+                    else:
+                        self.remove_share_node(shareNode)
+        for s in shares:
+            if s['id'] not in existing:
+                self._integrate_share_into_node_structure(s)
         self.isPopulated = True
     
     def ui_command_refresh(self):
@@ -4365,10 +4745,10 @@ class Shared(ConfigNode):
             data = rCache.get_bps(myOrgOnly=True)
             req = {'sharedResourceType': 'BLUEPRINT'}
         elif shareType == 'VM image':
-            data = rClient.get_images()
+            data = rCache.get_images()
             req = {'sharedResourceType': 'LIBRARY_VM'}
         elif shareType == 'disk image':
-            data = rClient.get_diskimages()
+            data = rCache.get_diskimages()
             req = {'sharedResourceType': 'DISK_IMAGE'}
         allowed = []
         for j in data:
@@ -4421,11 +4801,10 @@ class Shared(ConfigNode):
             completions = [a for a in ['@prompt']
                            if a.startswith(text)]
         elif current_param == 'blueprint':
-            allowedBlueprints = ['@prompt']
-            for bp in rCache.get_bps(myOrgOnly=True):
-                allowedBlueprints.append(bp['name'])
-            completions = [a for a in allowedBlueprints
-                           if a.startswith(text)]
+            return completer.complete(
+                'myOrgBpNames', text, ['bps', 'users'],
+                lambda: [bp['name'] for bp in rCache.get_bps(myOrgOnly=True)],
+                fixed=['@prompt'])
         else:
             completions = []
         if len(completions) == 1:
@@ -4448,11 +4827,10 @@ class Shared(ConfigNode):
             completions = [a for a in ['@prompt']
                            if a.startswith(text)]
         elif current_param == 'image':
-            allowedImages = ['@prompt']
-            for img in rClient.get_images():
-                allowedImages.append(img['name'])
-            completions = [a for a in allowedImages
-                           if a.startswith(text)]
+            return completer.complete(
+                'imageNames', text, ['images'],
+                lambda: [img['name'] for img in rCache.get_images()],
+                fixed=['@prompt'])
         else:
             completions = []
         if len(completions) == 1:
@@ -4475,11 +4853,10 @@ class Shared(ConfigNode):
             completions = [a for a in ['@prompt']
                            if a.startswith(text)]
         elif current_param == 'image':
-            allowedImages = ['@prompt']
-            for img in rClient.get_diskimages():
-                allowedImages.append(img['name'])
-            completions = [a for a in allowedImages
-                           if a.startswith(text)]
+            return completer.complete(
+                'diskImageNames', text, ['diskImages'],
+                lambda: [img['name'] for img in rCache.get_diskimages()],
+                fixed=['@prompt'])
         else:
             completions = []
         if len(completions) == 1:
@@ -4495,6 +4872,7 @@ class SharedFromUser(ConfigNode):
     """
     
     def __init__(self, uid, parent):
+        self.uid = uid
         try:
             self.email = rCache.get_user(uid)['email']
             name = c.replace_bad_chars_with_underscores(self.email)
@@ -4550,13 +4928,13 @@ class Share(ConfigNode):
         # Shorten the resourceType
         self.resourceType = resourceTypeShortener[s['sharedResourceType']]
         # Translate resource ID into a name
-        resId = s['sharedResourceId']
+        resId = self.resourceId = s['sharedResourceId']
         if self.resourceType in 'BP':
             j = rCache.get_bp(resId)
         elif self.resourceType in 'VM':
-            j = rClient.get_image(resId)
+            j = rCache.get_image(resId)
         elif self.resourceType in 'DISK':
-            j = rClient.get_diskimage(resId)
+            j = rCache.get_diskimage(resId)
         if j and 'name' in j:
             self.resource = '"{}"'.format(j['name'])
             self.name = c.replace_bad_chars_with_underscores(j['name'])
@@ -4589,7 +4967,9 @@ class Share(ConfigNode):
         outputFile = self.ui_eval_param(outputFile, 'string', '@EDITOR')
         description = "share definition for {} {} (/shared/{}/{}/{})".format(
             self.resourceType, self.resource, self.parent.parent.name, self.parent.name, self.name)
-        ui.print_obj(rCache.get_share(self.shareId), description, outputFile,
+        share = [s for s in rClient.get_shares({'sharedResourceId': self.resourceId})
+                 if s['id'] == self.shareId]
+        ui.print_obj(share[0] if share else None, description, outputFile,
             tmpPrefix='share_{}_{}'.format(self.resourceType, self.shareId))
         
     def ui_complete_print_def(self, parameters, text, current_param):
@@ -4618,18 +4998,7 @@ class Share(ConfigNode):
                 raise
             print(c.green("Deleted share {}\n".format(self.shareId)))
             rCache.purge_share_cache(self.shareId)
-            self.parent.parent.parent.numberOfShares -= 1
-            self.parent.parent.numberOfShares -= 1
-            self.parent.numberOfShares -= 1
-            if not self.parent.parent.numberOfShares:
-                # If the sharing user has no more shares, remove everything
-                rootNode.get_child('shared').remove_child(self.parent.parent)
-            elif not self.parent.numberOfShares:
-                # Or if theere are no more resources shared TO the same target, remove that
-                self.parent.parent.remove_child(self.parent)
-            else:
-                # Otherwise, just remove ourself
-                self.parent.remove_child(self)
+            rootNode.get_child('shared').remove_share_node(self)
         else:
             print("Leaving share intact\n")
     
@@ -4662,11 +5031,12 @@ class Keypairs(ConfigNode):
             return ("To populate, run: refresh", False)
     
     def refresh(self):
-        self._children = set([])
-        self.numberOfKps = 0
         rCache.purge_keypair_cache()
-        for kp in rCache.get_keypairs():
-            Keypair(kp, self)
+        reconcile_children(
+            self, rCache.get_keypairs(), 'kpId',
+            lambda kp: c.replace_bad_chars_with_underscores(kp['name']),
+            lambda kp: Keypair(kp, self))
+        self.numberOfKps = len(self._children)
         self.isPopulated = True
     
     def ui_command_refresh(self):
@@ -4752,7 +5122,8 @@ class Keypair(ConfigNode):
         self.kpString = c.replace_bad_chars_with_underscores(kp['name'])
         ConfigNode.__init__(self, self.kpString, parent)
         parent.numberOfKps += 1
-        self.kp = kp
+        self.kpId = kp['id']
+        self.kpName = kp['name']
         if 'creator' in kp:
             user = kp['creator']['nickname']
         else:
@@ -4785,9 +5156,9 @@ class Keypair(ConfigNode):
         print()
         outputFile = self.ui_eval_param(outputFile, 'string', '@EDITOR')
         description = "key pair definition for '{}' (/keypairs/{})".format(
-            self.kp['name'], self.kp['id'])
-        ui.print_obj(self.kp, description, outputFile,
-            tmpPrefix='keypair_{}'.format(self.kp['id']))
+            self.kpName, self.kpId)
+        ui.print_obj(rClient.get_keypair(self.kpId), description, outputFile,
+            tmpPrefix='keypair_{}'.format(self.kpId))
     
     def ui_complete_print_def(self, parameters, text, current_param):
         if current_param == 'outputFile':
@@ -4806,18 +5177,18 @@ class Keypair(ConfigNode):
         print()
         if not noconfirm:
             print(c.yellow("This will delete the '{}' public key from your account in Ravello"
-                           .format(self.kp['name'])))
+                           .format(self.kpName)))
             response = raw_input(c.CYAN("Continue with key deletion? [y/N] "))
             print()
         if noconfirm or response == 'y':
             try:
-                rClient.delete_keypair(self.kp['id'])
+                rClient.delete_keypair(self.kpId)
             except:
                 print(c.red("Problem deleting public key!\n"))
                 raise
             self.parent.numberOfKps -= 1
-            rCache.purge_keypair_cache(self.kp['id'])
-            print(c.green("Deleted public key '{}' ({})\n".format(self.kp['name'], self.kp['id'])))
+            rCache.purge_keypair_cache(self.kpId)
+            print(c.green("Deleted public key '{}' ({})\n".format(self.kpName, self.kpId)))
             self.parent.remove_child(self)
         else:
             print("Leaving key pair intact\n")
@@ -4852,14 +5223,14 @@ class Keypair(ConfigNode):
             else:
                 print(c.red("\nYou must enter a name!\n"))
                 return
-        req = {'name': name, 'id': self.kp['id']}
+        req = {'name': name, 'id': self.kpId}
         try:
             kp = rClient.update_keypair(req)
         except:
             print(c.red("\nProblem renaming public key!\n"))
             raise
-        print(c.green("\nSUCCESS! Public key {} renamed from '{}' to '{}'!".format(self.kp['id'], self.kp['name'], kp['name'])))
-        rCache.purge_keypair_cache(self.kp['id'])
+        print(c.green("\nSUCCESS! Public key {} renamed from '{}' to '{}'!".format(self.kpId, self.kpName, kp['name'])))
+        rCache.purge_keypair_cache(self.kpId)
         newKp = Keypair(kp, self.parent)
         self.parent.remove_child(self)
         print()
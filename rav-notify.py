@@ -18,6 +18,11 @@ import os
 # Custom modules
 from modules import string_ops as c
 from modules.ui_methods import get_timestamp_proximity, sanitize_timestamp
+from modules import rate_limit, transport
+from modules.cfg import (
+    defaultSharedBudgetRate, defaultSharedBudgetFile, defaultRateLimits,
+    defaultThrottleRetries, defaultHttpPoolSize, defaultHttpConnectTimeout,
+    defaultHttpReadTimeout, defaultHttpCompression)
 try:
     from modules import ravello_sdk
     ravello_sdk.is_rsaw_sdk()
@@ -60,6 +65,35 @@ def debug(*objs):
         print("DEBUG:", *objs, file=sys.stderr)
 
 
+def get_setting(cfg, key, default, isValid, requirement):
+    """Return value of *key* from config dict *cfg* if isValid(value), else *default*."""
+    value = cfg.get(key, default)
+    if isValid(value):
+        return value
+    print(c.yellow(
+        "Error: Ignoring configFile `{}` directive because it's not {}\n"
+        "  (Using default value: {})".format(key, requirement, default)))
+    return default
+
+
+def get_rate_limits(cfg):
+    """Return request class limits, w/valid ones from *cfg* overriding defaults."""
+    limits = dict((k, dict(v)) for k, v in defaultRateLimits.items())
+    rateLimits = cfg.get('rateLimits', {})
+    if not isinstance(rateLimits, dict):
+        print(c.yellow("Error: Ignoring configFile `rateLimits` directive because it's not a dict"))
+        return limits
+    for k, v in rateLimits.items():
+        if (k in defaultRateLimits and isinstance(v, dict) and
+                all(isinstance(v.get(n), (int, float)) and v[n] >= 0 for n in ('rate', 'burst'))):
+            limits[k] = {'rate': v['rate'], 'burst': v['burst']}
+        else:
+            print(c.yellow(
+                "Error: Ignoring configFile `rateLimits` key `{}` because it's not a "
+                "known request class with numeric rate & burst".format(k)))
+    return limits
+
+
 def update_myAppIds(myAppIds=[]):
     """Refresh global myAppIds list by querying for my applications."""
     for app in rClient.get_applications(): 
@@ -189,6 +223,7 @@ def main(argparseOptions):
             "Note: unable to read configFile '{}'; using defaults"
             .format(rOpt.configFile)))
         nick = user = passwd = messg = events = None
+        cfg = {}
     else:
         nick   = cfg.get('nickname', None)
         user   = cfg.get('ravelloUser', None)
@@ -196,6 +231,28 @@ def main(argparseOptions):
         messg  = cfg.get('unableToLoginAdditionalMsg', None)
         events = cfg.get('eventsOfInterest', None)
     
+    # Same API request pacing & http settings as ravshello
+    isNumber = lambda v: isinstance(v, (int, float)) and not isinstance(v, bool)
+    budgetRate = get_setting(
+        cfg, 'sharedBudgetRate', defaultSharedBudgetRate,
+        lambda v: isNumber(v) and v >= 0, "a non-negative number")
+    budgetFile = get_setting(
+        cfg, 'sharedBudgetFile', defaultSharedBudgetFile,
+        lambda v: isinstance(v, basestring), "a string")
+    rateLimits = get_rate_limits(cfg)
+    throttleRetries = get_setting(
+        cfg, 'throttleRetries', defaultThrottleRetries,
+        lambda v: isinstance(v, int) and not isinstance(v, bool) and v >= 0,
+        "a non-negative integer")
+    http = {}
+    for k, default in (('httpPoolSize', defaultHttpPoolSize),
+                       ('httpConnectTimeout', defaultHttpConnectTimeout),
+                       ('httpReadTimeout', defaultHttpReadTimeout)):
+        http[k] = get_setting(cfg, k, default, lambda v: isNumber(v) and v > 0, "a positive number")
+    httpCompression = get_setting(
+        cfg, 'httpCompression', defaultHttpCompression,
+        lambda v: isinstance(v, bool), "a boolean")
+    
     if rOpt.kerberos:
         appnamePrefix = 'k:' + rOpt.kerberos + '__'
     elif nick:
@@ -233,6 +290,19 @@ def main(argparseOptions):
         sys.exit(3)
     
     rClient = ravello_sdk.RavelloClient()
+    transport.install(
+        rClient, poolSize=int(http['httpPoolSize']), connectTimeout=http['httpConnectTimeout'],
+        readTimeout=http['httpReadTimeout'], compress=httpCompression)
+    # Share the host-wide request budget w/ravshello processes (if configured)
+    hostBudget = None
+    if budgetRate:
+        budgetFile = os.path.expanduser(budgetFile)
+        try:
+            hostBudget = rate_limit.HostBudget(budgetFile, budgetRate)
+        except OSError as e:
+            debug("Not sharing API request budget; unable to open {}: {}".format(budgetFile, e.strerror))
+    rate_limit.RequestScheduler(
+        rClient, limits=rateLimits, maxRetries=throttleRetries, hostBudget=hostBudget)
     try:
         # Try to log in.
         rClient.login(rOpt.ravelloUser, rOpt.ravelloPass)
@@ -298,6 +368,10 @@ def main(argparseOptions):
                 }
             runningApps.append(a)
     
+    # Nobody's waiting on the requests made from here on, so they're paced as
+    # polling ones
+    rate_limit.set_priority(rate_limit.POLLING)
+    
     # Run forever-loop to watch for notifications or expiring apps.
     while 1:
         
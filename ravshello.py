@@ -21,12 +21,14 @@ from __future__ import print_function
 import argparse
 import yaml
 import os
+import re
+import atexit
 from sys import exit, stderr
 from glob import glob
 
 # Custom modules
 from modules import string_ops as c
-from modules import ravello_cache
+from modules import ravello_cache, api_trace, rate_limit
 from modules import auth_local, auth_ravello, user_interface, cfg
 
 
@@ -152,6 +154,43 @@ def main():
               "returns http status 401/429, times out, or raises ValueError "
               "(note that using this will override an explicit 'maxClientRetries' "
               "setting from a config file)".format(cfg.defaultMaxClientRetries)))
+    grpU.add_argument(
+        '--cache-snapshot', dest='cacheSnapshot', action='store_true',
+        help=("Load cached blueprints, users, shares & keypairs from a snapshot "
+              "file in CFGDIR at startup & save them back at exit (note that "
+              "using this will override an explicit 'cacheSnapshot=false' "
+              "setting from a config file)"))
+    grpU.add_argument(
+        '--prefetch', action='store_true',
+        help=("Fetch users, blueprints, keypairs, shares, cost buckets & app "
+              "list in parallel in the background right after logging in "
+              "(note that using this will override an explicit "
+              "'prefetch=false' setting from a config file)"))
+    grpU.add_argument(
+        '--speculate', action='store_true',
+        help=("Fetch VM details & VNC URLs of an app in the background "
+              "whenever you cd into it or one of its VMs (note that using "
+              "this will override an explicit 'speculate=false' setting "
+              "from a config file)"))
+    grpU.add_argument(
+        '--reuse-session', dest='reuseSession', action='store_true',
+        help=("Save the Ravello session to a file in CFGDIR (mode 0600) and "
+              "reuse it in later runs instead of logging in again, as long as "
+              "it's valid (note that using this will override an explicit "
+              "'reuseSession=false' setting from a config file)"))
+    grpU.add_argument(
+        '--shared-budget', dest='sharedBudgetRate', metavar='RATE', type=float,
+        help=("Share a budget of RATE API requests per second evenly among all "
+              "ravshello & rav-notify processes on this host that are making "
+              "requests (note that using this will override a "
+              "'sharedBudgetRate' setting from a config file)"))
+    grpU.add_argument(
+        '--trace-api', dest='traceApiFile', metavar='FILE',
+        help=("Append a line of json to FILE for every Ravello API call, with "
+              "the ravshello command that caused it, the http requests made, "
+              "their status, retries, bytes & wall time; view a per-command "
+              "summary with T() in the directsdk shell (note that using this "
+              "will override a 'traceApiFile' setting from a config file)"))
     grpU.add_argument(
         '-n', '--nocolor', dest='enableColor', action='store_false',
         help="Disable all color terminal enhancements")
@@ -200,6 +239,11 @@ def main():
         '-A', '--allapps', dest='showAllApps', action='store_true',
         help=("Show all applications, including ones not associated with your "
               "user (automatically triggers --admin option)"))
+    grpA.add_argument(
+        '--refresh-all', dest='refreshAll', action='store_true',
+        help=("Refresh apps, blueprints, users, events, shared & keypairs in "
+              "parallel at startup, same as the root refresh_all command "
+              "(admin only)"))
     grpA_0 = grpA.add_mutually_exclusive_group()
     grpA_0.add_argument(
         '-0', '--stdin', dest='useStdin', action='store_true',
@@ -265,6 +309,18 @@ def main():
     apply_config_file('/etc/{}/config.yaml'.format(cfg.prog))
     # Read user config file
     apply_config_file(os.path.join(rOpt.userCfgDir, rOpt.cfgFileName))
+    # Cache settings start from defaults & are overridden from cfgfile below
+    rOpt.cacheTtl = dict(cfg.defaultCacheTtl)
+    rOpt.cacheMaxEntries = cfg.defaultCacheMaxEntries
+    rOpt.cacheMaxStale = cfg.defaultCacheMaxStale
+    rOpt.cacheWatchInterval = cfg.defaultCacheWatchInterval
+    rOpt.rateLimits = dict((k, dict(v)) for k, v in cfg.defaultRateLimits.items())
+    rOpt.throttleRetries = cfg.defaultThrottleRetries
+    rOpt.sharedBudgetFile = cfg.defaultSharedBudgetFile
+    rOpt.httpPoolSize = cfg.defaultHttpPoolSize
+    rOpt.httpConnectTimeout = cfg.defaultHttpConnectTimeout
+    rOpt.httpReadTimeout = cfg.defaultHttpReadTimeout
+    rOpt.httpCompression = cfg.defaultHttpCompression
     # Do some checking of cfgfile options
     if cfg.cfgFile:
         # Handle include files
@@ -307,7 +363,152 @@ def main():
                     "Error: Ignoring configFile `maxClientRetries` directive because it's not an int\n"
                     "  (Using default value: {})\n"
                     "  See /usr/share/{}/config.yaml for example".format(cfg.defaultMaxClientRetries, cfg.prog)), file=stderr)
-    
+        # Validate cacheTtl
+        cacheTtl = cfg.cfgFile.get('cacheTtl', {})
+        if isinstance(cacheTtl, dict):
+            for k, v in cacheTtl.items():
+                if k in cfg.defaultCacheTtl and isinstance(v, (int, float)) and v >= 0:
+                    rOpt.cacheTtl[k] = v
+                else:
+                    print(c.yellow(
+                        "Error: Ignoring configFile `cacheTtl` key `{}` because it's not a known type with a number of seconds\n"
+                        "  See /usr/share/{}/config.yaml for example".format(k, cfg.prog)), file=stderr)
+        else:
+            print(c.yellow(
+                "Error: Ignoring configFile `cacheTtl` directive because it's not a dict\n"
+                "  See /usr/share/{}/config.yaml for example".format(cfg.prog)), file=stderr)
+        # Validate cacheMaxEntries
+        cacheMaxEntries = cfg.cfgFile.get('cacheMaxEntries', cfg.defaultCacheMaxEntries)
+        if isinstance(cacheMaxEntries, int) and cacheMaxEntries >= 0:
+            rOpt.cacheMaxEntries = cacheMaxEntries
+        else:
+            print(c.yellow(
+                "Error: Ignoring configFile `cacheMaxEntries` directive because it's not an int\n"
+                "  (Using default value: {})\n"
+                "  See /usr/share/{}/config.yaml for example".format(cfg.defaultCacheMaxEntries, cfg.prog)), file=stderr)
+        # Validate cacheSnapshot
+        cacheSnapshot = cfg.cfgFile.get('cacheSnapshot', False)
+        if isinstance(cacheSnapshot, bool):
+            if cacheSnapshot:
+                rOpt.cacheSnapshot = True
+        else:
+            print(c.yellow(
+                "Error: Ignoring configFile `cacheSnapshot` directive because it's not a boolean\n"
+                "  See /usr/share/{}/config.yaml for example".format(cfg.prog)), file=stderr)
+        # Validate cacheMaxStale
+        cacheMaxStale = cfg.cfgFile.get('cacheMaxStale', cfg.defaultCacheMaxStale)
+        if isinstance(cacheMaxStale, int) and cacheMaxStale >= 0:
+            rOpt.cacheMaxStale = cacheMaxStale
+        else:
+            print(c.yellow(
+                "Error: Ignoring configFile `cacheMaxStale` directive because it's not an int\n"
+                "  (Using default value: {})\n"
+                "  See /usr/share/{}/config.yaml for example".format(cfg.defaultCacheMaxStale, cfg.prog)), file=stderr)
+        # Validate cacheWatchInterval
+        cacheWatchInterval = cfg.cfgFile.get('cacheWatchInterval', cfg.defaultCacheWatchInterval)
+        if isinstance(cacheWatchInterval, int) and cacheWatchInterval >= 0:
+            rOpt.cacheWatchInterval = cacheWatchInterval
+        else:
+            print(c.yellow(
+                "Error: Ignoring configFile `cacheWatchInterval` directive because it's not an int\n"
+                "  (Using default value: {})\n"
+                "  See /usr/share/{}/config.yaml for example".format(cfg.defaultCacheWatchInterval, cfg.prog)), file=stderr)
+        # Validate prefetch
+        prefetch = cfg.cfgFile.get('prefetch', False)
+        if isinstance(prefetch, bool):
+            if prefetch:
+                rOpt.prefetch = True
+        else:
+            print(c.yellow(
+                "Error: Ignoring configFile `prefetch` directive because it's not a boolean\n"
+                "  See /usr/share/{}/config.yaml for example".format(cfg.prog)), file=stderr)
+        # Validate speculate
+        speculate = cfg.cfgFile.get('speculate', False)
+        if isinstance(speculate, bool):
+            if speculate:
+                rOpt.speculate = True
+        else:
+            print(c.yellow(
+                "Error: Ignoring configFile `speculate` directive because it's not a boolean\n"
+                "  See /usr/share/{}/config.yaml for example".format(cfg.prog)), file=stderr)
+        # Validate rateLimits
+        rateLimits = cfg.cfgFile.get('rateLimits', {})
+        if isinstance(rateLimits, dict):
+            for k, v in rateLimits.items():
+                if (k in cfg.defaultRateLimits and isinstance(v, dict) and
+                        all(isinstance(v.get(n), (int, float)) and v[n] >= 0 for n in ('rate', 'burst'))):
+                    rOpt.rateLimits[k] = {'rate': v['rate'], 'burst': v['burst']}
+                else:
+                    print(c.yellow(
+                        "Error: Ignoring configFile `rateLimits` key `{}` because it's not a known request class with numeric rate & burst\n"
+                        "  See /usr/share/{}/config.yaml for example".format(k, cfg.prog)), file=stderr)
+        else:
+            print(c.yellow(
+                "Error: Ignoring configFile `rateLimits` directive because it's not a dict\n"
+                "  See /usr/share/{}/config.yaml for example".format(cfg.prog)), file=stderr)
+        # Validate throttleRetries
+        throttleRetries = cfg.cfgFile.get('throttleRetries', cfg.defaultThrottleRetries)
+        if isinstance(throttleRetries, int) and throttleRetries >= 0:
+            rOpt.throttleRetries = throttleRetries
+        else:
+            print(c.yellow(
+                "Error: Ignoring configFile `throttleRetries` directive because it's not a non-negative integer\n"
+                "  (Using default value: {})\n"
+                "  See /usr/share/{}/config.yaml for example".format(cfg.defaultThrottleRetries, cfg.prog)), file=stderr)
+        # Validate reuseSession
+        reuseSession = cfg.cfgFile.get('reuseSession', False)
+        if isinstance(reuseSession, bool):
+            if reuseSession:
+                rOpt.reuseSession = True
+        else:
+            print(c.yellow(
+                "Error: Ignoring configFile `reuseSession` directive because it's not a boolean\n"
+                "  See /usr/share/{}/config.yaml for example".format(cfg.prog)), file=stderr)
+        # Validate http transport settings
+        for k in ('httpPoolSize', 'httpConnectTimeout', 'httpReadTimeout'):
+            v = cfg.cfgFile.get(k, getattr(rOpt, k))
+            if isinstance(v, (int, float)) and not isinstance(v, bool) and v > 0:
+                setattr(rOpt, k, v)
+            else:
+                print(c.yellow(
+                    "Error: Ignoring configFile `{}` directive because it's not a positive number\n"
+                    "  (Using default value: {})\n"
+                    "  See /usr/share/{}/config.yaml for example".format(k, getattr(rOpt, k), cfg.prog)), file=stderr)
+        rOpt.httpPoolSize = int(rOpt.httpPoolSize)
+        httpCompression = cfg.cfgFile.get('httpCompression', cfg.defaultHttpCompression)
+        if isinstance(httpCompression, bool):
+            rOpt.httpCompression = httpCompression
+        else:
+            print(c.yellow(
+                "Error: Ignoring configFile `httpCompression` directive because it's not a boolean\n"
+                "  See /usr/share/{}/config.yaml for example".format(cfg.prog)), file=stderr)
+        # Validate sharedBudgetRate & sharedBudgetFile
+        sharedBudgetRate = cfg.cfgFile.get('sharedBudgetRate', cfg.defaultSharedBudgetRate)
+        if rOpt.sharedBudgetRate is None:
+            if isinstance(sharedBudgetRate, (int, float)) and sharedBudgetRate >= 0:
+                rOpt.sharedBudgetRate = sharedBudgetRate
+            else:
+                print(c.yellow(
+                    "Error: Ignoring configFile `sharedBudgetRate` directive because it's not a non-negative number\n"
+                    "  See /usr/share/{}/config.yaml for example".format(cfg.prog)), file=stderr)
+        sharedBudgetFile = cfg.cfgFile.get('sharedBudgetFile', cfg.defaultSharedBudgetFile)
+        if isinstance(sharedBudgetFile, basestring):
+            rOpt.sharedBudgetFile = os.path.expanduser(sharedBudgetFile)
+        else:
+            print(c.yellow(
+                "Error: Ignoring configFile `sharedBudgetFile` directive because it's not a string\n"
+                "  (Using default value: {})\n"
+                "  See /usr/share/{}/config.yaml for example".format(cfg.defaultSharedBudgetFile, cfg.prog)), file=stderr)
+        # Validate traceApiFile
+        traceApiFile = cfg.cfgFile.get('traceApiFile', None)
+        if rOpt.traceApiFile is None and traceApiFile is not None:
+            if isinstance(traceApiFile, basestring):
+                rOpt.traceApiFile = os.path.expanduser(traceApiFile)
+            else:
+                print(c.yellow(
+                    "Error: Ignoring configFile `traceApiFile` directive because it's not a string\n"
+                    "  See /usr/share/{}/config.yaml for example".format(cfg.prog)), file=stderr)
+
     # Set sshKeyFile var to none if missing
     cfg.cfgFile['sshKeyFile'] = cfg.cfgFile.get('sshKeyFile', None)
     
@@ -325,7 +526,41 @@ def main():
     
     # 2.) Use ravello_sdk.RavelloClient() object to log in to Ravello
     cfg.rClient = auth_ravello.login()
-    cfg.rCache = ravello_cache.RavelloCache(cfg.rClient)
+    hostBudget = None
+    if rOpt.sharedBudgetRate:
+        try:
+            hostBudget = rate_limit.HostBudget(rOpt.sharedBudgetFile, rOpt.sharedBudgetRate)
+        except OSError as e:
+            print(c.yellow(
+                "Warning: Not sharing API request budget w/other processes; "
+                "unable to open '{}': {}".format(rOpt.sharedBudgetFile, e.strerror)), file=stderr)
+    cfg.rScheduler = rate_limit.RequestScheduler(
+        cfg.rClient, limits=rOpt.rateLimits, maxRetries=rOpt.throttleRetries,
+        hostBudget=hostBudget)
+    if rOpt.traceApiFile:
+        try:
+            cfg.rClient = api_trace.TracingClient(cfg.rClient, rOpt.traceApiFile)
+        except IOError as e:
+            print(c.red("Unable to open API trace file: {}".format(e)), file=stderr)
+            exit(1)
+    cfg.rCache = ravello_cache.RavelloCache(
+        cfg.rClient, ttl=rOpt.cacheTtl, maxEntries=rOpt.cacheMaxEntries,
+        maxStale=rOpt.cacheMaxStale)
+    if cfg.user and not rOpt.showAllApps:
+        # Only apps w/the same prefix user_interface.main() uses are shown, so
+        # don't bother downloading the rest of the org's apps
+        cfg.rCache.set_app_list_filter('{}{}__'.format(cfg.appnameNickPrefix, cfg.user))
+    if rOpt.cacheSnapshot:
+        # Snapshot file is per Ravello user, since each sees different objects
+        snapshotFile = os.path.join(
+            rOpt.userCfgDir,
+            'cache-{}.json'.format(re.sub(r'[^\w.@-]', '_', rOpt.ravelloUser)))
+        cfg.rCache.load_snapshot(snapshotFile)
+        atexit.register(cfg.rCache.save_snapshot, snapshotFile)
+    if rOpt.cacheWatchInterval:
+        cfg.rCache.watch_notifications(rOpt.cacheWatchInterval)
+    if rOpt.prefetch:
+        cfg.rCache.prefetch()
     
     # 3.) Launch main configShell user interface
     #     It will read options and objects from the cfg module